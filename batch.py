@@ -0,0 +1,234 @@
+"""
+Headless batch runner of tasks 1-3 for scenario files (no prompts and no GUI).
+
+Scenario is a dict (JSON object, TOML table or CSV row):
+ - name: scenario's name (directory of its results);
+ - tasks: list of solved tasks (1, 2, 3);
+ - data: input data for stochastic modelling (dict or path of CSV file like 'init/data.csv');
+ - events: directory with 'event_<k>.txt' files, glob pattern or list of TXT files of flight complexes' events
+   (task 1);
+ - p_req: required probability for the amount of flight complexes (optional);
+ - costs, counts: integer costs and available amounts of flight complexes for the mixed fleet of task 1
+   (see fleet.size_fleet, optional);
+ - clarify: clarified 'r0', 'rn', 'n_steps', 'n_tests' of task 2 (optional, one pass if absent);
+ - pwr: approximation polynomial power;
+ - share, steps: variation share and amount of variation steps of task 3;
+ - seed, method, estimator: stochastic modelling options.
+JSON file has a scenario or a list of scenarios, TOML file has a scenario or '[[scenario]]' tables,
+each row of CSV file is the input data of a scenario (other keys are taken from command line defaults).
+"""
+import argparse
+import glob
+import json
+import os
+import tomllib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from time import perf_counter
+
+import numpy as np
+
+import data_init
+import fleet
+import solver
+from storage import ResultSink
+
+defaults = {'tasks': [1, 2, 3], 'events': 'init', 'p_req': None, 'costs': None, 'counts': None, 'clarify': None,
+            'pwr': 2, 'share': 0.1, 'steps': 2, 'seed': None, 'method': 'mc', 'estimator': 'plain'}
+
+
+def load_scenarios(path: str, base: dict = None) -> list:
+    """
+    Loads scenarios from JSON, TOML or CSV file.
+    :param path: scenario file's path
+    :param base: default keys of scenarios (see defaults)
+    :return: list of scenarios
+    """
+    base = dict(defaults if base is None else base)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.json':
+        with open(path, 'r') as f:
+            raw = json.load(f)
+        raw = raw if isinstance(raw, list) else [raw]
+    elif ext == '.toml':
+        with open(path, 'rb') as f:
+            raw = tomllib.load(f)
+        raw = raw['scenario'] if 'scenario' in raw else [raw]
+    elif ext == '.csv':
+        raw = [{'data': row} for row in data_init.read_csv(path)]
+    else:
+        print(f"Error {ValueError}: unknown scenario file's format ({path})!")
+        raise ValueError
+    scenarios = []
+    for i, sc in enumerate(raw):
+        sc = {**base, 'name': stem if len(raw) == 1 else f"{stem}_{i + 1}", **sc}
+        if isinstance(sc.get('data'), str):
+            sc['data'] = data_init.read_csv(sc['data'])[0]
+        if 'data' not in sc and {2, 3} & set(sc['tasks']):
+            print(f"Error {ValueError}: no input data in scenario '{sc['name']}' ({path})!")
+            raise ValueError
+        scenarios.append(sc)
+    return scenarios
+
+
+def run_scenario(scenario: dict, out_dir: str = 'results/batch') -> dict:
+    """
+    Solves tasks of the scenario and writes its results to '<out_dir>/<name>/' (log, result.json and text files
+    of stochastic modelling).
+    :param scenario: scenario (see module's docs)
+    :param out_dir: directory of results
+    :return: results of tasks
+    """
+    path = os.path.join(out_dir, str(scenario['name']))
+    os.makedirs(path, exist_ok=True)
+    t = perf_counter()
+    with open(os.path.join(path, 'log.txt'), 'w') as log, redirect_stdout(log):
+        result = {'name': scenario['name']}
+        if 1 in scenario['tasks']:
+            result['task1'] = solve_task1(scenario)
+        if 2 in scenario['tasks']:
+            result['task2'] = solve_task2(scenario, path)
+            if 'task1' in result:
+                full_prob = result['task1']['p_max'] * result['task2']['p_max']
+                result['task2']['full_prob'] = full_prob
+                if scenario['p_req'] is not None:
+                    result['task2']['n_fc'] = solver.get_needed_n(full_prob, scenario['p_req'])
+        if 3 in scenario['tasks']:
+            result['task3'] = solve_task3(scenario, path)
+    result['time'] = perf_counter() - t
+    with open(os.path.join(path, 'result.json'), 'w') as f:
+        json.dump(result, f, indent=2, default=float)
+    return result
+
+
+def solve_task1(scenario: dict) -> dict:
+    """
+    Chooses the most efficient flight complex.
+    :param scenario: scenario (see module's docs)
+    :return: probabilities of flight complexes, number of the best one, its probability, needed amount
+    and the cheapest mixed fleet
+    """
+    probs = fleet.evaluate_complexes(event_paths(scenario['events']))
+    res = {'probs': probs.tolist(), 'best': int(probs.argmax()) + 1, 'p_max': float(probs.max())}
+    if scenario['p_req'] is not None:
+        res['n_fc'] = solver.get_needed_n(res['p_max'], scenario['p_req'])
+        n, cost, prob = fleet.size_fleet(probs, scenario['p_req'], scenario['costs'], scenario['counts'])
+        res['fleet'] = {'counts': n.tolist(), 'cost': cost, 'prob': float(prob)}
+    print(f"Task 1: flight complex number {res['best']} has max probability P = {res['p_max']}")
+    return res
+
+
+def event_paths(events) -> list:
+    """
+    Resolves TXT files of flight complexes' events.
+    :param events: directory with 'event_<k>.txt' files (ordered by k), glob pattern or list of files
+    :return: list of files
+    """
+    if not isinstance(events, str):
+        return list(events)
+    if os.path.isdir(events):
+        return data_init.event_files(events, 'event_*.txt')
+    return data_init.sort_event_paths(glob.glob(events))
+
+
+def solve_task2(scenario: dict, path: str) -> dict:
+    """
+    Calculates the max target defeat probability (the clarified pass is used if it's set).
+    :param scenario: scenario (see module's docs)
+    :param path: directory of scenario's results
+    :return: hit point coordinate r* and max target defeat probability
+    """
+    data = dict(scenario['data'])
+    if scenario['clarify'] is not None:
+        data.update({key: str(value) for key, value in scenario['clarify'].items()})
+    kwargs = {key: scenario[key] for key in ('seed', 'method', 'estimator')}
+    r, probs = solver.stochastic_modelling(data, to_files=False, **kwargs)
+    solver.export_text(r, probs, os.path.join(path, 'results.txt'), os.path.join(path, 'plot.txt'))
+    _, extr_max = solver.approximate(r, probs, scenario['pwr'])
+    res = {'r_max': float(np.squeeze(extr_max.x)), 'p_max': float(np.squeeze(extr_max.fun))}
+    print(f"Task 2: max P = {res['p_max']}, r* = {res['r_max']}")
+    return res
+
+
+def solve_task3(scenario: dict, path: str) -> dict:
+    """
+    Analyzes D1, D2 and sigma influence on the max target defeat probability.
+    Runs of all grid points are recorded to 'runs' shards of the scenario's directory (see storage.ResultSink).
+    :param scenario: scenario (see module's docs)
+    :param path: directory of scenario's results
+    :return: max probability point
+    """
+    data = dict(scenario['data'])
+    if scenario['clarify'] is not None:
+        data.update({key: str(value) for key, value in scenario['clarify'].items()})
+    share, n = float(scenario['share']), int(scenario['steps']) + 1
+    if n < 2 or share < 0 or share > 1:
+        print(f"Error {ValueError}: n must be > 1 or variation percent must be in [0; 1]!")
+        raise ValueError()
+    D1, D2, sigma = (np.linspace(float(data[key]), float(data[key]) * (1 + share), n) for key in ('D1', 'D2', 'sigma'))
+    _, _, res_max = solver.analyze(data, D1, D2, sigma, pwr=scenario['pwr'], seed=scenario['seed'],
+                                   method=scenario['method'], estimator=scenario['estimator'],
+                                   sink=ResultSink(os.path.join(path, 'runs')))
+    res = {key: float(np.squeeze(value)) for key, value in res_max.items()}
+    print(f"Task 3: max probability for point (D1, D2, sigma) = ({res['D1']}, {res['D2']}, {res['sigma']}) "
+          f"is {res['prob']}")
+    return res
+
+
+def run_batch(scenarios: list, out_dir: str = 'results/batch', workers: int = 1) -> tuple:
+    """
+    Runs scenarios concurrently in the process pool.
+    :param scenarios: list of scenarios
+    :param out_dir: directory of results
+    :param workers: amount of worker processes (serial run if 1)
+    :return: (results of scenarios in their order, throughput in scenarios per hour)
+    """
+    if workers < 1:
+        print(f"Error {ValueError}: amount of workers must be >= 1!")
+        raise ValueError()
+    names = [str(sc['name']) for sc in scenarios]
+    if len(set(names)) != len(names):
+        print(f"Error {ValueError}: scenarios' names must be unique!")
+        raise ValueError()
+    t = perf_counter()
+    results = [None] * len(scenarios)
+    if workers == 1:
+        for i, sc in enumerate(scenarios):
+            results[i] = run_scenario(sc, out_dir)
+            print(f"[{i + 1}/{len(scenarios)}] '{sc['name']}' is done ({results[i]['time']:.3g} s)")
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run_scenario, sc, out_dir): i for i, sc in enumerate(scenarios)}
+            for k, future in enumerate(as_completed(futures)):
+                i = futures[future]
+                results[i] = future.result()
+                print(f"[{k + 1}/{len(scenarios)}] '{scenarios[i]['name']}' is done ({results[i]['time']:.3g} s)")
+    elapsed = perf_counter() - t
+    return results, len(scenarios) / elapsed * 3600
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Headless batch runner of tasks 1-3 for scenario files.")
+    parser.add_argument('scenarios', nargs='+', help="scenario files (JSON, TOML or CSV)")
+    parser.add_argument('-o', '--out', default='results/batch', help="directory of results")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help="amount of worker processes")
+    parser.add_argument('--tasks', type=int, nargs='+', default=defaults['tasks'], help="default solved tasks")
+    parser.add_argument('--events', default=defaults['events'], help="default directory of events' files")
+    parser.add_argument('--seed', type=int, default=None, help="default seed")
+    parser.add_argument('--method', choices=solver.methods, default=defaults['method'], help="default method")
+    args = parser.parse_args(argv)
+
+    base = dict(defaults, tasks=args.tasks, events=args.events, seed=args.seed, method=args.method)
+    scenarios = [sc for path in args.scenarios for sc in load_scenarios(path, base)]
+    results, throughput = run_batch(scenarios, args.out, min(args.workers, len(scenarios)))
+    summary = {'scenarios': len(results), 'scenarios_per_hour': throughput,
+               'results': {res['name']: os.path.join(args.out, str(res['name'])) for res in results}}
+    with open(os.path.join(args.out, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    print(f"{len(results)} scenarios are done: {throughput:.4g} scenarios/hour")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
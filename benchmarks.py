@@ -0,0 +1,318 @@
+"""
+Benchmarks of the solver hot paths.
+Run 'python benchmarks.py --help' for the headless benchmark suite of tasks 1-3 with the baseline comparison.
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+from time import perf_counter, process_time
+
+import numpy as np
+from scipy import stats
+
+import data_init
+import kernels
+import solver
+from my_types import FlightComplex
+
+# Scale factors of scenarios relative to the shipped 'init/' data
+scales = (1, 10, 100)
+base_complexes = 100        # Flight complexes of the base fleet (shipped complexes are repeated)
+base_cells = 2              # Steps of each parameter of the base sweep (2x2x2 cells)
+
+
+def reference_modelling(data: dict) -> tuple:
+    """
+    Reference (per-sample scalar loop) implementation of the stochastic modelling.
+    :param data: input data for stochastic modelling
+    :return: (hit points radii, mean target defeat probabilities)
+    """
+    R, D1, D2, sigma, r0, rn, n_steps, N = solver.prepare_values(data)
+    r = np.linspace(r0, rn, n_steps + 1)
+    phi = stats.uniform(scale=2 * np.pi)
+    x_fc_dist = [stats.norm(loc=ri, scale=sigma) for ri in r]
+    y_fc_dist = stats.norm(scale=sigma)
+
+    probs = []
+    for i in range(r.size):
+        temp_probs = []
+        for _ in range(N):
+            x_fc, y_fc = x_fc_dist[i].rvs(), y_fc_dist.rvs()
+            x_targ, y_targ = solver.target_coords(R, phi.rvs())
+            d = np.sqrt((x_fc - x_targ)**2 + (y_fc - y_targ)**2)
+            temp_probs.append(solver.defeat_law(d, D1, D2))
+        probs.append(np.array(temp_probs).mean())
+    return r, np.array(probs)
+
+
+def timeit(func, *args, repeat: int = 1, **kwargs) -> float:
+    """
+    Measures the best execution time of the function.
+    :param func: benchmarked function
+    :param repeat: amount of runs
+    :return: best time, s
+    """
+    best = np.inf
+    for _ in range(repeat):
+        t = perf_counter()
+        func(*args, **kwargs)
+        best = min(best, perf_counter() - t)
+    return best
+
+
+def bench_vectorized(data: dict, repeat: int = 5) -> dict:
+    """
+    Compares the vectorized stochastic modelling with the reference scalar loop.
+    :param data: input data for stochastic modelling
+    :param repeat: amount of runs of the vectorized implementation
+    :return: times of both implementations and the speedup
+    """
+    t_ref = timeit(reference_modelling, data)
+    t_vec = timeit(solver.stochastic_modelling, data, to_files=False, repeat=repeat)
+    return {'reference': t_ref, 'vectorized': t_vec, 'speedup': t_ref / t_vec}
+
+
+def bench_estimators(data: dict, n_reps: int = 30, seed=None) -> dict:
+    """
+    Compares variance reduction estimators of the stochastic modelling with the plain Monte Carlo.
+    Efficiency is the inverse of variance (mean over steps) per CPU second of one run.
+    :param data: input data for stochastic modelling
+    :param n_reps: amount of independent runs for each estimator
+    :param seed: seed of runs' random streams
+    :return: variance, CPU time, efficiency and efficiency relative to the plain Monte Carlo for each estimator
+    """
+    seeds = solver.children(solver.seed_sequence(seed), n_reps)
+    results = {}
+    for estimator in solver.estimators:
+        t = process_time()
+        probs = np.array([solver.stochastic_modelling(data, to_files=False, seed=ss, estimator=estimator)[1]
+                          for ss in seeds])
+        cpu_time = (process_time() - t) / n_reps
+        variance = probs.var(axis=0, ddof=1).mean()
+        results[estimator] = {'variance': variance, 'cpu_time': cpu_time, 'efficiency': 1 / (variance * cpu_time)}
+    for estimator in solver.estimators:
+        results[estimator]['relative'] = results[estimator]['efficiency'] / results['plain']['efficiency']
+    return results
+
+
+def bench_kernels(data: dict, repeat: int = 3, reference: bool = True) -> dict:
+    """
+    Compares compiled kernels of stochastic modelling with the reference scalar loop and the vectorized engine.
+    :param data: input data for stochastic modelling
+    :param repeat: amount of runs of each implementation
+    :param reference: benchmark the (slow) reference scalar loop too
+    :return: throughput (samples per second) of each implementation
+    """
+    R, D1, D2, sigma, r0, rn, n_steps, N = solver.prepare_values(data)
+    r = np.linspace(r0, rn, n_steps + 1)
+    seeds = solver.seed_sequence(1).generate_state(r.size)
+    runs = {'vectorized': lambda: solver.stochastic_modelling(data, to_files=False, seed=1),
+            'kernel numpy': lambda: kernels._defeat_sums_numpy(r, R, D1, D2, sigma, N, seeds, 2**16)}
+    if kernels.HAVE_NUMBA:
+        kernels.defeat_sums(r, R, D1, D2, sigma, 1, seeds)              # compilation
+        kernels.defeat_sums(r, R, D1, D2, sigma, 1, seeds, parallel=True)
+        runs['kernel numba'] = lambda: kernels.defeat_sums(r, R, D1, D2, sigma, N, seeds)
+        runs['kernel numba parallel'] = lambda: kernels.defeat_sums(r, R, D1, D2, sigma, N, seeds, parallel=True)
+    if reference:
+        runs['reference'] = lambda: reference_modelling(data)
+    return {name: r.size * N / timeit(run, repeat=1 if name == 'reference' else repeat) for name, run in runs.items()}
+
+
+def peak_memory(func, *args, **kwargs) -> int:
+    """
+    Measures the peak memory of Python and NumPy allocations of the function.
+    :param func: benchmarked function
+    :return: peak memory, bytes
+    """
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def synthetic_fleet(directory: str, n_complexes: int, src: str = 'init') -> list:
+    """
+    Writes events' TXT files of the synthetic fleet (shipped flight complexes are repeated).
+    :param directory: target directory
+    :param n_complexes: amount of flight complexes
+    :param src: directory with shipped 'event_*.txt' files
+    :return: paths of TXT files
+    """
+    shipped = sorted(os.path.join(src, f) for f in os.listdir(src) if f.startswith('event_') and f.endswith('.txt'))
+    paths = [os.path.join(directory, f"event_{i + 1:06d}.txt") for i in range(n_complexes)]
+    for i, path in enumerate(paths):
+        shutil.copyfile(shipped[i % len(shipped)], path)
+    return paths
+
+
+def bench_scenario(func, n_items: int, unit: str, repeat: int = 3) -> dict:
+    """
+    Measures the best time, throughput and peak memory of the scenario.
+    :param func: scenario's function without arguments
+    :param n_items: amount of processed items (samples or complexes) per run
+    :param unit: throughput's unit
+    :param repeat: amount of timed runs
+    :return: {'time': s, 'throughput': items per second, 'unit': unit, 'peak_mb': MiB}
+    """
+    t = timeit(func, repeat=repeat)
+    return {'time': t, 'throughput': n_items / t, 'unit': unit, 'peak_mb': peak_memory(func) / 2**20}
+
+
+def run_suite(data: dict, scale_factors: tuple = scales, repeat: int = 3, seed: int = 1) -> dict:
+    """
+    Runs benchmarks of tasks 1-3 hot paths for scenarios of each scale (headless, without prompts and files):
+     - task1 read: reading events by data_init.read_events and solver.delivery_probs, complexes/s;
+     - task1 stream: chunked reading and solver.delivery_probs_stream, complexes/s;
+     - task2: solver.stochastic_modelling with scaled n_tests, samples/s;
+     - task3: solver.analyze with the scaled amount of sweep cells, samples/s;
+     - task3 pool: the same sweep using the shared-memory sample pool, samples/s.
+    :param data: input data for stochastic modelling
+    :param scale_factors: scale factors of scenarios
+    :param repeat: amount of timed runs of each scenario
+    :param seed: seed of random streams
+    :return: results of scenarios (see bench_scenario) by names 'task/scale'
+    """
+    R, D1, D2, sigma, r0, rn, n_steps, N = solver.prepare_values(data)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in scale_factors:
+            # Task 1
+            n_complexes = base_complexes * scale
+            paths = synthetic_fleet(tmp, n_complexes)
+            results[f"task1 read/{scale}x"] = bench_scenario(
+                lambda: solver.delivery_probs([FlightComplex(i + 1, data_init.read_events(path))
+                                               for i, path in enumerate(paths)]),
+                n_complexes, 'complexes/s', repeat)
+            results[f"task1 stream/{scale}x"] = bench_scenario(
+                lambda: list(solver.delivery_probs_stream(data_init.iter_event_chunks(paths))),
+                n_complexes, 'complexes/s', repeat)
+            # Task 2
+            data2 = dict(data, n_tests=N * scale)
+            results[f"task2/{scale}x"] = bench_scenario(
+                lambda: solver.stochastic_modelling(data2, to_files=False, seed=seed),
+                (n_steps + 1) * N * scale, 'samples/s', repeat)
+            # Task 3 (the amount of cells grows as the scale)
+            n = max(int(round((base_cells**3 * scale)**(1 / 3))), 2)
+            grid = [np.linspace(x, 1.1 * x, n) for x in (D1, D2, sigma)]
+            results[f"task3/{scale}x"] = bench_scenario(
+                lambda: _quiet(solver.analyze, data, *grid, seed=seed),
+                n**3 * (n_steps + 1) * N, 'samples/s', 1)
+            results[f"task3 pool/{scale}x"] = bench_scenario(
+                lambda: _quiet(solver.analyze, data, *grid, seed=seed, pool=True),
+                n**3 * (n_steps + 1) * N, 'samples/s', repeat)
+    return results
+
+
+def _quiet(func, *args, **kwargs):
+    with redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+def bench_imports(modules: tuple = ('solver', 'interface', 'batch'),
+                  lazy: tuple = ('matplotlib', 'scipy.stats', 'scipy.optimize')) -> dict:
+    """
+    Measures the import time of modules in fresh interpreters ('-X importtime') and checks that heavy
+    dependencies are imported lazily.
+    :param modules: measured modules
+    :param lazy: dependencies which must not be imported by modules at startup
+    :return: cumulative import time (s) and the eagerly imported heavy dependencies for each module
+    """
+    results = {}
+    for module in modules:
+        err = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], capture_output=True,
+                             text=True, check=True).stderr
+        # Lines are 'import time: self [us] | cumulative | imported package'
+        rows = [line.split('|') for line in err.splitlines() if line.startswith('import time:') and '|' in line]
+        times = {name.strip(): int(cumulative) for _, cumulative, name in rows[1:]}
+        results[module] = {'time': times[module] / 1e6,
+                           'eager': sorted(name for name in times if name.startswith(lazy))}
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.2) -> list:
+    """
+    Compares results of the suite with the baseline.
+    :param results: results of the suite (see run_suite)
+    :param baseline: baseline results of the suite
+    :param tolerance: allowed relative loss of throughput or growth of peak memory
+    :return: regressions' descriptions
+    """
+    regressions = []
+    for name, res in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if res['throughput'] < (1 - tolerance) * base['throughput']:
+            regressions.append(f"{name}: throughput {res['throughput']:.4g} < {base['throughput']:.4g} {res['unit']}")
+        if res['peak_mb'] > (1 + tolerance) * base['peak_mb']:
+            regressions.append(f"{name}: peak memory {res['peak_mb']:.4g} > {base['peak_mb']:.4g} MiB")
+    return regressions
+
+
+def print_suite(results: dict, baseline: dict = None):
+    """
+    Prints the table of results of the suite.
+    :param results: results of the suite (see run_suite)
+    :param baseline: baseline results of the suite
+    """
+    print(f"{'scenario':<20}{'time, s':>10}{'throughput':>14} {'unit':<12}{'peak, MiB':>10}{'vs baseline':>13}")
+    for name, res in results.items():
+        ratio = f"{res['throughput'] / baseline[name]['throughput']:.2f}x" if baseline and name in baseline else ''
+        print(f"{name:<20}{res['time']:>10.4g}{res['throughput']:>14.4g} {res['unit']:<12}{res['peak_mb']:>10.4g}"
+              f"{ratio:>13}")
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Headless benchmarks of tasks 1-3 hot paths.")
+    parser.add_argument('--data', default='init/data.csv', help="CSV file of input data")
+    parser.add_argument('--scales', type=int, nargs='+', default=list(scales), help="scale factors of scenarios")
+    parser.add_argument('--repeat', type=int, default=3, help="amount of timed runs of each scenario")
+    parser.add_argument('--baseline', default='results/benchmark_baseline.json', help="baseline JSON file")
+    parser.add_argument('--save-baseline', action='store_true', help="save results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument('--legacy', action='store_true',
+                        help="also compare the vectorized engine, estimators and kernels with the reference loop")
+    args = parser.parse_args(argv)
+
+    data = data_init.read_csv(args.data)[0]
+    if args.legacy:
+        for key, value in bench_vectorized(data).items():
+            print(f"{key}: {value}")
+        for estimator, res in bench_estimators(data).items():
+            print(f"{estimator}: " + ", ".join(f"{key} = {value:.4g}" for key, value in res.items()))
+        for name, throughput in bench_kernels(data).items():
+            print(f"{name}: {throughput:.4g} samples/s")
+
+    results = run_suite(data, tuple(args.scales), args.repeat)
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    print_suite(results, baseline)
+    imports = bench_imports()
+    for module, res in imports.items():
+        print(f"import {module}: {res['time']:.4g} s" + (f", eager imports: {res['eager']}" if res['eager'] else ''))
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline is saved to '{args.baseline}'")
+        return 0
+    regressions = compare(results, baseline, args.tolerance) if baseline else []
+    regressions += [f"import {module}: {', '.join(res['eager'])} imported at startup"
+                    for module, res in imports.items() if res['eager']]
+    for reg in regressions:
+        print(f"Regression: {reg}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    exit(main())
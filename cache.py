@@ -0,0 +1,131 @@
+"""
+On-disk cache of stochastic modelling results.
+"""
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+
+class ResultCache:
+    """
+    Content-addressed cache of stochastic modelling results with LRU eviction.
+    Entries are keyed on (R, D1, D2, sigma, r0, rn, n_steps, n_tests, seed, method, estimator).
+    Entries of the same family (all the keys except the r grid) share points, so a coarser or overlapping
+    r grid reuses the cached points and only the missing ones are calculated (random streams of Monte Carlo
+    steps are keyed by radii, see solver.step_streams, so points don't depend on the grid).
+    """
+    grid_keys = ('r0', 'rn', 'n_steps')
+
+    def __init__(self, directory: str = 'results/cache', max_bytes: int = 256 * 2**20):
+        """
+        :param directory: cache directory
+        :param max_bytes: max size of cached entries, bytes
+        """
+        self.directory, self.max_bytes = directory, max_bytes
+        self.index_path = os.path.join(directory, 'index.json')
+        os.makedirs(directory, exist_ok=True)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self.index = json.load(f)
+
+    def __len__(self):
+        return len(self.index)
+
+    @staticmethod
+    def digest(params: dict) -> str:
+        """
+        Calculates the content address of parameters.
+        :param params: parameters
+        :return: SHA-256 hex digest
+        """
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    def normalize(self, data: dict, seed: str, method: str, estimator: str) -> dict:
+        """
+        Makes the canonical parameters of the run.
+        :param data: input data of stochastic modelling
+        :param seed: seed's string (the analytic method doesn't use it)
+        :param method: stochastic modelling method
+        :param estimator: Monte Carlo variance reduction scheme
+        :return: parameters
+        """
+        params = {key: float(data[key]) for key in ('R', 'D1', 'D2', 'sigma', 'r0', 'rn')}
+        params.update(n_steps=int(data['n_steps']), n_tests=int(data['n_tests']),
+                      seed=None if method == 'analytic' else seed, method=method, estimator=estimator)
+        return params
+
+    def lookup(self, params: dict, r: np.ndarray) -> tuple:
+        """
+        Looks up cached points of the r grid in the entries of the parameters' family (most recent first).
+        :param params: parameters (see normalize)
+        :param r: hit points radii
+        :return: (probabilities, standard errors, mask of missing points)
+        """
+        probs, std_errs, missing = np.full(r.size, np.nan), np.full(r.size, np.nan), np.ones(r.size, dtype=bool)
+        family = self.family(params)
+        entries = sorted((key for key, e in self.index.items() if e['family'] == family),
+                         key=lambda key: self.index[key]['atime'], reverse=True)
+        for key in entries:
+            if not missing.any():
+                break
+            with np.load(os.path.join(self.directory, key + '.npz')) as entry:
+                r_c, probs_c, std_errs_c = entry['r'], entry['probs'], entry['std_errs']
+            idx = np.abs(r_c - r[:, np.newaxis]).argmin(axis=1)
+            found = missing & np.isclose(r_c[idx], r, rtol=1e-12, atol=1e-12)
+            if found.any():
+                probs[found], std_errs[found] = probs_c[idx[found]], std_errs_c[idx[found]]
+                missing &= ~found
+                self.index[key]['atime'] = time.time()
+        self.save_index()
+        return probs, std_errs, missing
+
+    def store(self, params: dict, r: np.ndarray, probs: np.ndarray, std_errs: np.ndarray):
+        """
+        Stores the run and evicts the least recently used entries if the cache is too large.
+        :param params: parameters (see normalize)
+        :param r: hit points radii
+        :param probs: mean target defeat probabilities
+        :param std_errs: standard errors of probabilities
+        """
+        key = self.digest(params)
+        path = os.path.join(self.directory, key + '.npz')
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, r=r, probs=probs, std_errs=std_errs)
+        os.replace(path + '.tmp', path)
+        self.index[key] = {'family': self.family(params), 'size': os.path.getsize(path), 'atime': time.time(),
+                           **{k: params[k] for k in self.grid_keys}}
+        # LRU eviction
+        size = sum(e['size'] for e in self.index.values())
+        for old in sorted(self.index, key=lambda k: self.index[k]['atime']):
+            if size <= self.max_bytes or old == key:
+                break
+            size -= self.index.pop(old)['size']
+            os.remove(os.path.join(self.directory, old + '.npz'))
+        self.save_index()
+
+    def family(self, params: dict) -> str:
+        """
+        Calculates the content address of parameters without the r grid.
+        :param params: parameters
+        :return: SHA-256 hex digest
+        """
+        return self.digest({k: v for k, v in params.items() if k not in self.grid_keys})
+
+    @staticmethod
+    def cacheable(seed, method: str) -> bool:
+        """
+        Checks that the run can be cached: unseeded Monte Carlo runs draw fresh samples each time.
+        :param seed: seed of the run
+        :param method: stochastic modelling method
+        :return: the run can be cached
+        """
+        return seed is not None or method == 'analytic'
+
+    def save_index(self):
+        with open(self.index_path + '.tmp', 'w') as f:
+            json.dump(self.index, f)
+        os.replace(self.index_path + '.tmp', self.index_path)
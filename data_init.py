@@ -1,6 +1,13 @@
 import csv
+import glob
+import io
+import os
+import re
+from itertools import islice
 
-from my_types import EventA
+import numpy as np
+
+from my_types import EventA, EventTable
 
 
 def read_events(path: str, sep: str = ' '):
@@ -18,6 +25,90 @@ def read_events(path: str, sep: str = ' '):
         return events
 
 
+# Structured record of event: (complex number, event's name, distribution's code, tau, 1st and 2nd parameters)
+event_dtype = np.dtype([('complex', np.int64), ('id', 'U16'), ('code', np.int8),
+                        ('tau', float), ('p1', float), ('p2', float)])
+# Rows with one parameter (exponential distribution) are padded by NaN for the bulk reader
+_short_row = re.compile(r'^(\S+\s+\S+\s+\S+\s+\S+)[ \t]*$', re.MULTILINE)
+_number = re.compile(r'(\d+)\.txt$')
+
+
+def sort_event_paths(paths) -> list:
+    """
+    Sorts TXT files of flight complexes' events by their numbers ('event_2.txt' before 'event_10.txt'),
+    files without numbers go last in names' order.
+    :param paths: files' paths
+    :return: sorted list of files' paths
+    """
+    def key(path: str) -> tuple:
+        match = _number.search(os.path.basename(path))
+        return (0, int(match.group(1)), path) if match else (1, 0, path)
+
+    return sorted(paths, key=key)
+
+
+def event_files(directory: str, pattern: str = '*.txt') -> list:
+    """
+    Lists TXT files of flight complexes' events in the directory ordered by their numbers (see sort_event_paths).
+    :param directory: directory with files
+    :param pattern: pattern of files' names
+    :return: list of files' paths
+    """
+    return sort_event_paths(glob.glob(os.path.join(directory, pattern)))
+
+
+def iter_event_chunks(paths, chunk_size: int = 65536):
+    """
+    Reads events of flight complexes from TXT files (one file - one complex) by chunks.
+    Each chunk is parsed by the bulk NumPy reader, so memory is bounded by the chunk's size regardless
+    of files' sizes and amount.
+    :param paths: list of source TXT files' paths or the directory with them (ordered by files' numbers)
+    :param chunk_size: max amount of events in the chunk
+    :return: generator of chunks - structured arrays of events (see event_dtype), complexes are numbered from 1
+    """
+    if isinstance(paths, str) and os.path.isdir(paths):
+        paths = event_files(paths)
+    lines, numbers = [], []
+    for i, path in enumerate(paths):
+        with open(path, 'r') as file:
+            while True:
+                part = list(islice(file, chunk_size - len(lines)))
+                if not part:
+                    break
+                if not part[-1].endswith('\n'):
+                    part[-1] += '\n'
+                lines += part
+                numbers.append((i + 1, len(part)))
+                if len(lines) == chunk_size:
+                    yield parse_events(lines, numbers)
+                    lines, numbers = [], []
+    if lines:
+        yield parse_events(lines, numbers)
+
+
+def parse_events(lines: list, numbers: list) -> np.ndarray:
+    """
+    Parses lines of events.
+    :param lines: lines of TXT files with events
+    :param numbers: list of (complex number, amount of its lines) in lines' order
+    :return: structured array of events (see event_dtype)
+    """
+    text = _short_row.sub(r'\1 nan', ''.join(lines))
+    raw = np.loadtxt(io.StringIO(text), ndmin=1, dtype=[('id', 'U16'), ('distrib', 'U16'),
+                                                        ('tau', float), ('p1', float), ('p2', float)])
+    events = np.empty(raw.size, dtype=event_dtype)
+    events['complex'] = np.repeat([n for n, _ in numbers], [k for _, k in numbers])
+    events['code'] = -1
+    for name, code in EventTable.codes.items():
+        events['code'][raw['distrib'] == name] = code
+    if (events['code'] < 0).any():
+        print(f"Error: no such distribution ({raw['distrib'][events['code'] < 0][0]}) in events' files!")
+        raise ValueError
+    for key in ('id', 'tau', 'p1', 'p2'):
+        events[key] = raw[key]
+    return events
+
+
 def txt2csv(fsrc, ftarg, head=None, sep=' '):
     """
     Reads data from TXT file and then writes it to CSV file.
@@ -0,0 +1,166 @@
+"""
+Task #1 engine for large pools of candidate flight complexes: parallel evaluation and mixed-fleet sizing.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import data_init
+import solver
+
+
+def evaluate_complexes(paths: list, workers: int = 1, chunk_size: int = 65536) -> np.ndarray:
+    """
+    Calculates the probability of successful payload delivery for each candidate flight complex.
+    Files are split into contiguous groups evaluated by the streaming reader in worker processes.
+    Complexes without events (empty files) have probability 1.
+    :param paths: TXT files of flight complexes' events (one file - one complex)
+    :param workers: amount of worker processes (serial run if 1)
+    :param chunk_size: max amount of events in the chunk of the reader
+    :return: probabilities in files' order
+    """
+    if workers < 1:
+        print(f"Error {ValueError}: amount of workers must be >= 1!")
+        raise ValueError()
+    paths = list(paths)
+    groups = [list(g) for g in np.array_split(np.array(paths, dtype=object), min(workers, max(len(paths), 1)))]
+    if workers == 1:
+        results = [_evaluate_group((g, chunk_size)) for g in groups]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_evaluate_group, [(g, chunk_size) for g in groups]))
+    return np.concatenate(results) if results else np.empty(0)
+
+
+def _evaluate_group(task: tuple) -> np.ndarray:
+    paths, chunk_size = task
+    if not paths:
+        return np.empty(0)
+    # Empty files have no events in chunks, so probabilities are placed by complexes' numbers
+    probs = np.ones(len(paths))
+    for numbers, p in solver.delivery_probs_stream(data_init.iter_event_chunks(paths, chunk_size)):
+        probs[numbers - 1] = p
+    return probs
+
+
+def size_fleet(probs: np.ndarray, p_req: float, costs: np.ndarray = None, counts: np.ndarray = None) -> tuple:
+    """
+    Finds the cheapest mixed fleet reaching the required probability: 1 - prod((1 - p_i)^n_i) >= p_req.
+    In logarithms it is the covering knapsack sum(n_i * w_i) >= W, w_i = -ln(1 - p_i), W = -ln(1 - p_req):
+     - unit costs: the greedy choice of the largest w_i is optimal (sorting of candidates);
+     - integer costs: dynamic programming over the total cost bounded by the greedy (by w_i / cost_i) solution,
+       candidates are pruned by dominance (cheaper and better ones) beforehand.
+    :param probs: probability of successful payload delivery of each candidate flight complex
+    :param p_req: required probability in [0; 1)
+    :param costs: positive integer cost of each candidate (unit costs if None)
+    :param counts: available amount of each candidate (unlimited if None)
+    :return: (amount of each candidate in the fleet, total cost, reached probability)
+    """
+    probs = np.asarray(probs, dtype=float)
+    if p_req < 0 or p_req >= 1 or probs.size == 0 or (probs < 0).any() or (probs > 1).any():
+        print(f"Error {ValueError}: probabilities must be in [0; 1] and required probability in [0; 1)!")
+        raise ValueError()
+    costs = np.ones(probs.size, dtype=np.int64) if costs is None else np.asarray(costs)
+    if costs.shape != probs.shape or (costs < 1).any() or (costs != np.round(costs)).any():
+        print(f"Error {ValueError}: costs must be positive integers for each candidate!")
+        raise ValueError()
+    costs = costs.astype(np.int64)
+    with np.errstate(divide='ignore'):
+        w = -np.log1p(-probs)
+    W = -np.log1p(-p_req)
+    # Tolerance of the rounding of sums of logarithms
+    W -= 1e-12 * max(W, 1.0)
+    available = None if counts is None else np.asarray(counts, dtype=np.int64)
+    if available is not None and available.shape != probs.shape:
+        print(f"Error {ValueError}: counts must be set for each candidate!")
+        raise ValueError()
+    if (w.max() <= 0 if available is None else np.where(available > 0, w * available, 0).sum() < W):
+        print(f"Error {ValueError}: required probability {p_req} can't be reached by candidates!")
+        raise ValueError()
+
+    if W <= 0:
+        n = np.zeros(probs.size, dtype=np.int64)
+    elif (costs == 1).all():
+        n = _greedy(w, W, available)
+    else:
+        bound = _greedy(w / costs, W, available, w) @ costs
+        n = (_dp_unbounded if available is None else _dp_bounded)(w, costs, W, bound, available)
+    return n, int(n @ costs), 1 - np.prod((1 - probs) ** n)
+
+
+def _greedy(key: np.ndarray, W: float, available: np.ndarray = None, w: np.ndarray = None) -> np.ndarray:
+    # Candidates are taken in descending order of key until the sum of weights w reaches W
+    w = key if w is None else w
+    n = np.zeros(key.size, dtype=np.int64)
+    if available is None:
+        best = np.flatnonzero(key == key.max())
+        best = best[w[best].argmax()]
+        n[best] = 1 if np.isinf(w[best]) else max(int(np.ceil(W / w[best])), 1)
+        return n
+    order = np.argsort(-key, kind='stable')
+    order = order[available[order] > 0]
+    total = np.cumsum(w[order] * available[order])
+    k = int(np.searchsorted(total, W))
+    n[order[:k]] = available[order[:k]]
+    rest = W - (total[k - 1] if k else 0.0)
+    i = order[k]
+    n[i] = min(1 if np.isinf(w[i]) else max(int(np.ceil(rest / w[i])), 1), available[i])
+    return n
+
+
+def _dp_unbounded(w: np.ndarray, costs: np.ndarray, W: float, bound: int, available: None) -> np.ndarray:
+    # Dominance: a candidate is useless if a cheaper (or equal) one has a larger (or equal) weight
+    order = np.lexsort((-w, costs))
+    keep = order[w[order] > np.maximum.accumulate(np.r_[-np.inf, w[order]])[:-1]]
+    c, wk = costs[keep], w[keep]
+    # best[t] - max weight of fleets with the total cost t, choice[t] - the last added candidate
+    best, choice = np.full(bound + 1, -np.inf), np.full(bound + 1, -1)
+    best[0] = 0.0
+    for t in range(1, bound + 1):
+        fits = c <= t
+        if not fits.any():
+            continue
+        values = best[t - c[fits]] + wk[fits]
+        j = values.argmax()
+        best[t], choice[t] = values[j], np.flatnonzero(fits)[j]
+        if best[t] >= W:
+            break
+    n = np.zeros(w.size, dtype=np.int64)
+    t = int(np.argmax(best >= W))
+    while t > 0:
+        n[keep[choice[t]]] += 1
+        t -= c[choice[t]]
+    return n
+
+
+def _dp_bounded(w: np.ndarray, costs: np.ndarray, W: float, bound: int, available: np.ndarray) -> np.ndarray:
+    # Units of candidates ordered by cost, then by weight (descending)
+    order = np.lexsort((-w, costs))
+    order = order[available[order] > 0]
+    units = np.repeat(order, np.minimum(available[order], bound // costs[order]))
+    # Dominance: a unit is needed only together with all the better (or equal) and cheaper (or equal) units
+    # (otherwise one of them replaces it), so it's useless if their total cost with its one exceeds the bound
+    keep, kept = [], np.empty(0, dtype=np.int64)
+    for c in np.unique(costs[units]):
+        same = units[costs[units] == c]
+        by_weight = kept[np.argsort(-w[kept], kind='stable')]
+        cum_costs = np.r_[0, np.cumsum(costs[by_weight])]
+        better = cum_costs[np.searchsorted(-w[by_weight], -w[same], side='right')]
+        keep.append(same[c + better + c * np.arange(same.size) <= bound])
+        kept = np.r_[kept, keep[-1]]
+    units = np.concatenate(keep)
+    # best[t] - max weight of fleets with the total cost <= t
+    best = np.zeros(bound + 1)
+    taken = np.zeros((units.size, bound + 1), dtype=bool)
+    for k, i in enumerate(units):
+        c = costs[i]
+        values = best[:bound + 1 - c] + w[i]
+        taken[k, c:] = values > best[c:]
+        best[c:] = np.maximum(best[c:], values)
+    n = np.zeros(w.size, dtype=np.int64)
+    t = int(np.argmax(best >= W))
+    for k in range(units.size - 1, -1, -1):
+        if taken[k, t]:
+            n[units[k]] += 1
+            t -= costs[units[k]]
+    return n
@@ -1,57 +1,88 @@
+import os
+
 import numpy as np
-import matplotlib.pyplot as plt
 
-from my_types import FlightComplex
+from cache import ResultCache
+from my_types import SampleStats
+from storage import ResultSink
 import data_init
+import fleet
 import solver
+import surrogate
+
+# Plots are saved to files instead of showing (the GUI backend and pyplot aren't imported at all)
+headless = bool(os.environ.get('FUT_HEADLESS'))
 
 
-def task1() -> tuple:
+def task1(directory: str = None, workers: int = 1) -> tuple:
     """
     Solves the problem of choosing of the most efficient flight complex.
+    :param directory: directory with TXT files of flight complexes' events ('init/event_*.txt' files if None)
+    :param workers: amount of worker processes evaluating flight complexes (see fleet.evaluate_complexes)
     :return: (probabilities for each flight complex, max probability)
     """
     print("\n*** TASK #1: choosing of the most efficient flight complex ***")
     # Init
-    n_complex = int(input("Amount of flight complexes: "))
-    if n_complex < 1:
-        print("Error: amount of complexes must be > 1!")
-        raise ValueError
-    paths = ['init/event_' + f"{i + 1}.txt" for i in range(n_complex)]
-    # Solution
-    complexes = []
-    for i, path in enumerate(paths):
-        events = data_init.read_events(path)
-        complexes.append(FlightComplex(i + 1, events))
+    if directory is None:
+        n_complex = int(input("Amount of flight complexes: "))
+        if n_complex < 1:
+            print("Error: amount of complexes must be > 1!")
+            raise ValueError
+        paths = ['init/event_' + f"{i + 1}.txt" for i in range(n_complex)]
+    else:
+        paths = directory
+    # Solution (events are read and processed by chunks)
+    if isinstance(paths, str):
+        paths = data_init.event_files(paths)
+    probs = fleet.evaluate_complexes(paths, workers)
 
     # Results
-    probs = np.array(solver.delivery_probs(complexes))
     print(f"Resulting probabilities: {probs}")
     print(f"Flight complex number {probs.argmax() + 1} has max probability P = {round(probs.max(), 5)}")
 
     return probs, probs.max()
 
 
-def task2() -> tuple:
+def task2(seed=None, method: str = 'mc', target_se: float = None, search: str = 'grid',
+          cache: ResultCache = None) -> tuple:
     """
     Solves the problem of the target defeat.
+    :param seed: seed of stochastic modelling random streams (OS entropy if None)
+    :param method: stochastic modelling method ('mc' or 'analytic')
+    :param target_se: target standard error of the clarified Monte Carlo run (fixed amount of tests if None)
+    :param search: 'grid' - grid with clarifying and approximation, 'golden' - golden-section search of r*
+    :param cache: result cache of stochastic modelling
     :return: (hit point coordinate r, max target defeat probability)
     """
     print("\n*** TASK #2: calculating the target's defeat probability ***")
     # Init
     data = data_init.read_csv(data_init.txt2csv('init/data.txt', 'init/data.csv'))[0]
+    if search == 'golden':
+        return task2_golden(data, seed)
+    # Samples of the first pass are reused by the clarified one: by sample statistics (Monte Carlo without cache)
+    # or by the cache (both passes and the base grid point of task #3 use the same seed, streams are keyed by radii)
+    seeds = [None, None] if seed is None else [solver.seed_sequence(seed)] * 2
+    state = SampleStats(seeds[0]) if method == 'mc' and cache is None else None
     # Run
-    hit_points, p_mean = solver.stochastic_modelling(data)
+    hit_points, p_mean = solver.stochastic_modelling(data, seed=seeds[0], method=method, cache=cache, state=state)
     # Visualization
     plot(hit_points, p_mean)
 
     # Clarify
     solver.clarify(data)
+    if state is not None:
+        solver.align_grid(data, state)
+        print(f"Grid is aligned with the first pass: r in [{data['r0']}; {data['rn']}], {data['n_steps']} breaks")
     pwr = solver.set_polynom_power()
     # Run
-    hit_points, p_mean = solver.stochastic_modelling(data)
+    std_errs = None
+    if target_se is not None and method == 'mc':
+        hit_points, p_mean, std_errs, _ = solver.adaptive_modelling(data, target_se, seed=seeds[1])
+    else:
+        hit_points, p_mean = solver.stochastic_modelling(data, seed=seeds[1], method=method, cache=cache,
+                                                         state=state)
     # Approximation
-    p_approx, extr_max = solver.approximate(hit_points, p_mean, pwr)
+    p_approx, extr_max = solver.approximate(hit_points, p_mean, pwr, std_errs=std_errs)
     # Visualization
     plot(hit_points, p_mean, p_approx)
 
@@ -67,8 +98,35 @@ def task2() -> tuple:
     return extr_max.x, extr_max.fun
 
 
-def task3():
-    """Solves the problem of the analyze input data influence."""
+def task2_golden(data: dict, seed=None) -> tuple:
+    """
+    Solves the problem of the target defeat using the golden-section search of r* (without clarifying).
+    :param data: input data for stochastic modelling
+    :param seed: seed of stochastic modelling random streams (OS entropy if None)
+    :return: (hit point coordinate r, max target defeat probability)
+    """
+    r_max, p_max, (p_low, p_high), n_samples = solver.optimize_hit_radius(data, seed=seed)
+    print(f"Max probability ({n_samples} samples):"
+          f"\n - max P: {p_max} (confidence band [{p_low}; {p_high}])"
+          f"\n - r*: {r_max}")
+    with open('results/clarify.txt', 'w') as file:
+        file.write(f"Max probability (golden-section search):"
+                   f"\n - max P: {p_max} (confidence band [{p_low}; {p_high}])\n"
+                   f"\n - r*: {r_max}")
+
+    return r_max, p_max
+
+
+def task3(workers: int = 1, seed=None, method: str = 'mc', cache: ResultCache = None, mode: str = 'grid'):
+    """
+    Solves the problem of the analyze input data influence.
+    :param workers: amount of worker processes for the parallel sweep
+    :param seed: seed of the sweep's random streams (OS entropy if None)
+    :param method: stochastic modelling method ('mc' or 'analytic')
+    :param cache: result cache of stochastic modelling
+    :param mode: 'grid' - full grid sweep, 'surrogate' - polynomial chaos surrogate with sensitivity indices
+    (see surrogate.surrogate_sweep, the amount of variation steps isn't used)
+    """
     print("\n*** TASK 3: analyze D1, D2 and sigma influence ***")
     data = data_init.read_csv('init/data.csv')[0]
     solver.clarify(data)
@@ -79,11 +137,16 @@ def task3():
         print(f"Error {ValueError}: n must be > 1 or variation percent must be in [0; 1]!")
         raise ValueError()
 
+    if mode == 'surrogate':
+        return task3_surrogate(data, share, workers, seed, method)
+
     D1 = np.linspace(float(data['D1']), float(data['D1']) * (1 + share), n)
     D2 = np.linspace(float(data['D2']), float(data['D2']) * (1 + share), n)
     sigma = np.linspace(float(data['sigma']), float(data['sigma']) * (1 + share), n)
 
-    r_res, p_res, res_max = solver.analyze(data, D1, D2, sigma)
+    # Runs of all grid points are recorded to 'results/runs' (flushed once per sweep)
+    r_res, p_res, res_max = solver.analyze(data, D1, D2, sigma, workers=workers, seed=seed, method=method,
+                                          cache=cache, sink=ResultSink())
 
     print(f"Max probability for point (D1, D2, sigma) =\n"
           f"({res_max['D1']}, {res_max['D2']}, {res_max['sigma']}) is {res_max['prob']}")
@@ -94,6 +157,31 @@ def task3():
     return res_max
 
 
+def task3_surrogate(data: dict, share: float, workers: int = 1, seed=None, method: str = 'mc') -> dict:
+    """
+    Solves the problem of the analyze input data influence using the surrogate model.
+    :param data: input data for stochastic modelling
+    :param share: variation share of D1, D2 and sigma
+    :param workers: amount of worker processes
+    :param seed: seed of the sweep's random streams (OS entropy if None)
+    :param method: stochastic modelling method ('mc' or 'analytic')
+    :return: max probability point with sensitivity indices
+    """
+    bounds = [(float(data[key]), float(data[key]) * (1 + share)) for key in surrogate.params]
+    res_max = surrogate.surrogate_sweep(data, bounds, workers=workers, seed=seed, method=method)
+    indices = "\n".join(f" - {key}: first order S = {s}, total S = {t}"
+                        for key, (s, t) in res_max['sensitivity'].items())
+    print(f"Max probability for point (D1, D2, sigma) =\n"
+          f"({res_max['D1']}, {res_max['D2']}, {res_max['sigma']}) is {res_max['prob']} "
+          f"({res_max['n_evals']} evaluations)\nSensitivity indices:\n{indices}")
+    with open('results/analyze.txt', 'w') as file:
+        file.write(f"Max probability for point (D1, D2, sigma) = "
+                   f"({res_max['D1']}, {res_max['D2']}, {res_max['sigma']}) is {res_max['prob']}\n"
+                   f"Sensitivity indices:\n{indices}")
+
+    return res_max
+
+
 def get_n_fc(p: float) -> tuple:
     """
     Calculates necessary number of flight complexes for target task achievement.
@@ -104,16 +192,36 @@ def get_n_fc(p: float) -> tuple:
     return solver.get_needed_n(p, p_req), p_req
 
 
+def get_fleet(probs: np.ndarray, costs: np.ndarray = None, counts: np.ndarray = None) -> tuple:
+    """
+    Calculates the cheapest mixed fleet of flight complexes for target task achievement (see fleet.size_fleet).
+    :param probs: probability of each flight complex
+    :param costs: integer cost of each flight complex (unit costs if None)
+    :param counts: available amount of each flight complex (unlimited if None)
+    :return: (amount of each flight complex, total cost, reached probability, required probability)
+    """
+    p_req = float(input(" - set required probability of target defeat [0; 1): "))
+    return (*fleet.size_fleet(probs, p_req, costs, counts), p_req)
+
+
 # Visualization
-def plot(x: np.ndarray, y: np.ndarray, y_approx: np.ndarray = None, title: str = None):
+def plot(x: np.ndarray, y: np.ndarray, y_approx: np.ndarray = None, title: str = None, path: str = None):
     """
-    Makes and show plots for results of stochastic modelling.
+    Makes and show plots for results of stochastic modelling (matplotlib is imported at the first call).
     :param x: x-argument for plots
     :param y: y-argument for plots
     :param y_approx: approximated y-arguments for plots
     :param title: title all of the plots
+    :param path: image file's path (the plot is shown if None; 'results/plot.png' in the headless mode)
     """
-    fig, ax = plt.subplots(figsize=(6, 4))
+    if headless or path is not None:
+        # Figure without pyplot doesn't need any GUI backend
+        from matplotlib.figure import Figure
+        fig = Figure(figsize=(6, 4))
+        ax = fig.subplots()
+    else:
+        import matplotlib.pyplot as plt
+        fig, ax = plt.subplots(figsize=(6, 4))
 
     ax.plot(x, y, 'b.', label='Средняя вероятность')
     ax.plot(x, y, color='gray', lw=1, ls=':')
@@ -127,7 +235,10 @@ def plot(x: np.ndarray, y: np.ndarray, y_approx: np.ndarray = None, title: str =
     ax.legend()
     ax.grid()
 
-    plt.show()
+    if headless or path is not None:
+        fig.savefig('results/plot.png' if path is None else path)
+    else:
+        plt.show()
 
 
 def color_plot(x: np.ndarray, y: np.ndarray):
@@ -0,0 +1,102 @@
+"""
+Compiled kernels of stochastic modelling (Numba if installed, pure NumPy otherwise).
+"""
+import numpy as np
+
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+
+def defeat_sums(r: np.ndarray, R: float, D1: float, D2: float, sigma: float, n: int, seeds: np.ndarray,
+                parallel: bool = False, chunk: int = 2**16) -> tuple:
+    """
+    Calculates sums of target defeat samples for each hit point radius in one pass: sampling, distance
+    and the defeat law are fused, so no temporary arrays of samples are created (Numba), or the samples
+    are processed in place by chunks (NumPy fallback). Each step's random stream has its own seed,
+    so results don't depend on the amount of threads, but they differ between Numba and NumPy.
+    :param r: hit points radii
+    :param R: target circle's radius
+    :param D1: diameter of the zone of unconditional target defeat
+    :param D2: diameter of the conditional target defeat zone
+    :param sigma: hit point standard deviation
+    :param n: amount of samples for each radius
+    :param seeds: 32-bit integer seed of each step (see solver.model_points)
+    :param parallel: run steps in parallel threads (Numba only)
+    :param chunk: amount of samples in the chunk (NumPy only)
+    :return: (sums of samples, sums of squared samples)
+    """
+    r = np.ascontiguousarray(r, dtype=float)
+    seeds = np.ascontiguousarray(np.broadcast_to(seeds, r.shape), dtype=np.int64)
+    if HAVE_NUMBA:
+        kernel = _defeat_sums_parallel if parallel else _defeat_sums_serial
+        return kernel(r, float(R), float(D1), float(D2), float(sigma), int(n), seeds)
+    return _defeat_sums_numpy(r, R, D1, D2, sigma, n, seeds, chunk)
+
+
+def _defeat_sums_numpy(r: np.ndarray, R: float, D1: float, D2: float, sigma: float, n: int, seeds: np.ndarray,
+                       chunk: int) -> tuple:
+    sums, sq_sums = np.zeros(r.size), np.zeros(r.size)
+    for i, ri in enumerate(r):
+        rng = np.random.default_rng(int(seeds[i]))
+        for start in range(0, n, chunk):
+            m = min(chunk, n - start)
+            z = rng.standard_normal((m, 2))
+            phi = rng.uniform(0, 2 * np.pi, m)
+            cos = np.cos(phi)
+            sin = np.sin(phi, out=phi)
+            # Hit point minus target (in place)
+            z *= sigma
+            z[:, 0] += ri
+            z[:, 0] -= np.multiply(cos, R, out=cos)
+            z[:, 1] -= np.multiply(sin, R, out=sin)
+            g = np.hypot(z[:, 0], z[:, 1], out=cos)
+            if D2 > D1:
+                np.subtract(D2, g, out=g)
+                g /= D2 - D1
+                np.clip(g, 0.0, 1.0, out=g)
+            else:
+                g = (g <= D1).astype(float)
+            sums[i] += g.sum()
+            sq_sums[i] += g @ g
+    return sums, sq_sums
+
+
+if HAVE_NUMBA:
+    @njit(cache=True)
+    def _defeat_law(d: float, D1: float, D2: float) -> float:
+        if d <= D1:
+            return 1.0
+        if d <= D2:
+            return (D2 - d) / (D2 - D1)
+        return 0.0
+
+    @njit(cache=True)
+    def _step_sums(ri: float, R: float, D1: float, D2: float, sigma: float, n: int, seed: int) -> tuple:
+        np.random.seed(seed)
+        s, s2 = 0.0, 0.0
+        for _ in range(n):
+            phi = np.random.uniform(0.0, 2 * np.pi)
+            dx = ri + sigma * np.random.standard_normal() - R * np.cos(phi)
+            dy = sigma * np.random.standard_normal() - R * np.sin(phi)
+            g = _defeat_law(np.sqrt(dx * dx + dy * dy), D1, D2)
+            s += g
+            s2 += g * g
+        return s, s2
+
+    @njit(cache=True)
+    def _defeat_sums_serial(r, R, D1, D2, sigma, n, seeds):
+        sums, sq_sums = np.zeros(r.size), np.zeros(r.size)
+        for i in range(r.size):
+            sums[i], sq_sums[i] = _step_sums(r[i], R, D1, D2, sigma, n, seeds[i])
+        return sums, sq_sums
+
+    @njit(cache=True, parallel=True)
+    def _defeat_sums_parallel(r, R, D1, D2, sigma, n, seeds):
+        sums, sq_sums = np.zeros(r.size), np.zeros(r.size)
+        for i in prange(r.size):
+            # Seeding inside the parallel loop affects only the current thread's generator
+            sums[i], sq_sums[i] = _step_sums(r[i], R, D1, D2, sigma, n, seeds[i])
+        return sums, sq_sums
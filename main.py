@@ -1,9 +1,27 @@
-import numpy as np
+import sys
 
 import interface
+import profiling
+from cache import ResultCache
 
 
-def main():
+def option(name: str, default: str = None) -> str:
+    """
+    Gets the value of the command line option ('name value').
+    :param name: option's name
+    :param default: default value
+    :return: option's value
+    """
+    args = sys.argv[1:]
+    return args[args.index(name) + 1] if name in args[:-1] else default
+
+
+def main(seed=None, cache: ResultCache = None):
+    """
+    Solves tasks using user's input.
+    :param seed: seed of stochastic modelling random streams (OS entropy if None)
+    :param cache: result cache of stochastic modelling (unseeded Monte Carlo runs aren't cached)
+    """
     try:
         # Task 1
         p_max1 = 1
@@ -18,7 +36,7 @@ def main():
 
         # Task 2
         if input("\nSolve task #2? (+/-): ") == '+':
-            r_max, p_max2 = interface.task2()
+            r_max, p_max2 = interface.task2(seed=seed, cache=cache)
             # Task 2.1 (additional)
             full_prob = p_max1 * p_max2
             print(f"\nFull probability for best flight complex: P = {full_prob}")
@@ -34,7 +52,7 @@ def main():
 
         # Task 3
         if input("\nSolve task #3? (+/-): ") == '+':
-            interface.task3()
+            interface.task3(seed=seed, cache=cache)
     except ValueError:
         print(f"Main Error {ValueError}!")
         exit(-1)
@@ -44,7 +62,17 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    # Plots are saved to files instead of showing
+    if '--headless' in sys.argv[1:]:
+        interface.headless = True
+    if '--profile' in sys.argv[1:]:
+        profiling.enable()
+    seed = option('--seed')
+    main(None if seed is None else int(seed), None if '--no-cache' in sys.argv[1:] else ResultCache())
+    if profiling.enabled:
+        print(profiling.summary())
+        profiling.export_json('results/profile.json')
+        profiling.export_chrome_trace('results/trace.json')
 else:
     print("Fatal Error: no entering point!")
     exit(-1)
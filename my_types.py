@@ -1,16 +1,20 @@
 """
 Helper types.
 """
-from scipy import stats
+import numpy as np
 
 
 class EventA:
     """
     Describes an event object for modeling world.
+    The distribution is resolved to its code at construction (see EventTable.codes).
     """
+    __slots__ = ('id', 'code', 'tau', 'm', 'sigma', 'lam', 'a', 'b')
+
     distribs = {'norm': ['t', 'mean', 'std'],
                 'uniform': ['t', 'a', 'b'],
                 'expon': ['tau', 'lambda']}
+    names = tuple(distribs.keys())
 
     def __init__(self, id: str, distrib: str, params: tuple):
         """
@@ -25,7 +29,7 @@ class EventA:
         if len(params) != len(self.distribs[distrib]):
             raise IndexError
         # Init
-        self.id, self.distrib = id, distrib
+        self.id, self.code = id, self.names.index(distrib)
         self.tau = None
         self.m, self.sigma, self.lam, self.a, self.b = None, None, None, None, None
         if distrib == 'norm':
@@ -38,6 +42,10 @@ class EventA:
                 print(f"Error {ValueError}: lambda parameter cannot be 0!")
                 raise ValueError
 
+    @property
+    def distrib(self) -> str:
+        return self.names[self.code]
+
     def __str__(self):
         out = f"Event '{self.id}' has distribution '{self.distrib}' with "
         if self.distrib == 'norm':
@@ -55,22 +63,38 @@ class EventA:
         :param fail_prob: calculate probability of failure (True) of success (False) - for exponential distribution
         :return: probability value
         """
-        if self.distrib == 'norm':
-            return stats.norm.cdf(self.tau + t_bias, loc=self.m, scale=self.sigma)
-        if self.distrib == 'uniform':
-            if fail_prob:
-                return stats.uniform.sf(self.tau + t_bias, loc=self.a, scale=self.b - self.a)
-            return stats.uniform.cdf(self.tau + t_bias, loc=self.a, scale=self.b - self.a)
-        if self.distrib == 'expon':
-            if fail_prob:
-                return stats.expon.sf(self.tau, scale=1/self.lam)
-            return stats.expon.cdf(self.tau, scale=1/self.lam)
+        return self._probs[self.code](self, t_bias, fail_prob)
+
+    # Probabilities are calculated as in scipy.stats, but without its arguments' processing
+    # (scipy.special is imported at the first call for the fast startup)
+    def _norm_prob(self, t_bias: float, fail_prob: bool):
+        from scipy import special
+        return special.ndtr((self.tau + t_bias - self.m) / self.sigma)
+
+    def _uniform_prob(self, t_bias: float, fail_prob: bool):
+        x = (self.tau + t_bias - self.a) / (self.b - self.a)
+        if x <= 0:
+            return np.float64(1.0 if fail_prob else 0.0)
+        if x >= 1:
+            return np.float64(0.0 if fail_prob else 1.0)
+        return np.float64(1.0 - x if fail_prob else x)
+
+    def _expon_prob(self, t_bias: float, fail_prob: bool):
+        x = self.tau / (1 / self.lam)
+        if x <= 0:
+            return np.float64(1.0 if fail_prob else 0.0)
+        from scipy import special
+        return np.exp(-x) if fail_prob else -special.expm1(-x)
+
+    _probs = (_norm_prob, _uniform_prob, _expon_prob)
 
 
 class FlightComplex:
     """
     Describes flight complex object containing events.
     """
+    __slots__ = ('id', 'events')
+
     def __init__(self, id: int, events: tuple):
         """
         :param id: flight complex private name
@@ -84,3 +108,151 @@ class FlightComplex:
         for i, ev in enumerate(self.events):
             out += f"\n {i + 1}) {ev}"
         return out
+
+
+class EventTable:
+    """
+    Describes events of flight complexes as columns (struct of arrays).
+    Events of each flight complex are contiguous and ordered as in the complex.
+    """
+    codes = {name: code for code, name in enumerate(EventA.names)}
+
+    def __init__(self, complex: np.ndarray, code: np.ndarray, tau: np.ndarray, m: np.ndarray = None,
+                 sigma: np.ndarray = None, a: np.ndarray = None, b: np.ndarray = None, lam: np.ndarray = None,
+                 ids: np.ndarray = None):
+        """
+        :param complex: flight complex number of each event
+        :param code: distribution's code of each event (see EventTable.codes)
+        :param tau: time of each event
+        :param m: mean (for normal distribution, NaN for others)
+        :param sigma: standard deviation (for normal distribution, NaN for others)
+        :param a: left boundary (for uniform distribution, NaN for others)
+        :param b: right boundary (for uniform distribution, NaN for others)
+        :param lam: intensity (for exponential distribution, NaN for others)
+        :param ids: flight complexes' private names, the i-th complex has the number i (unique numbers of events
+        if None), so complexes without events are kept
+        """
+        self.complex, self.code = np.asarray(complex, dtype=np.int64), np.asarray(code, dtype=np.int8)
+        self.tau = np.asarray(tau, dtype=float)
+        nan = np.full(self.tau.shape, np.nan)
+        self.m, self.sigma, self.a, self.b, self.lam = (nan.copy() if col is None else np.asarray(col, dtype=float)
+                                                        for col in (m, sigma, a, b, lam))
+        self.ids = np.unique(self.complex) if ids is None else np.asarray(ids)
+        # Numbers of flight complexes in order of ids
+        self.numbers = self.ids if ids is None else np.arange(self.ids.size)
+
+    def __len__(self):
+        return self.tau.size
+
+    def __str__(self):
+        return f"Table of {len(self)} events of {self.ids.size} flight complexes."
+
+    @classmethod
+    def from_complexes(cls, complexes: list):
+        """
+        Makes the table of events of flight complexes.
+        :param complexes: list of flight complexes
+        :return: table of events
+        """
+        events = [(i, ev) for i, fc in enumerate(complexes) for ev in fc.events]
+        cols = {key: [np.nan if getattr(ev, key) is None else getattr(ev, key) for _, ev in events]
+                for key in ('tau', 'm', 'sigma', 'a', 'b', 'lam')}
+        return cls([i for i, _ in events], [ev.code for _, ev in events], ids=[fc.id for fc in complexes], **cols)
+
+    @classmethod
+    def from_records(cls, events: np.ndarray):
+        """
+        Makes the table of events from the structured array (see data_init.event_dtype).
+        :param events: structured array of events
+        :return: table of events
+        """
+        nan = np.full(events.size, np.nan)
+        norm, uniform, expon = (events['code'] == cls.codes[key] for key in ('norm', 'uniform', 'expon'))
+        return cls(events['complex'], events['code'], events['tau'],
+                   m=np.where(norm, events['p1'], nan), sigma=np.where(norm, events['p2'], nan),
+                   a=np.where(uniform, events['p1'], nan), b=np.where(uniform, events['p2'], nan),
+                   lam=np.where(expon, events['p1'], nan))
+
+    @property
+    def nbytes(self) -> int:
+        """Memory of the table's columns, bytes."""
+        return sum(col.nbytes for col in (self.complex, self.code, self.tau, self.m, self.sigma, self.a, self.b,
+                                          self.lam))
+
+
+class SampleStats:
+    """
+    Describes sufficient statistics (sums, squared sums and amounts) of target defeat samples
+    for hit points radii, so that later passes of stochastic modelling can reuse earlier samples.
+    """
+    def __init__(self, seed=None):
+        """
+        :param seed: seed of samples' random streams (OS entropy if None)
+        """
+        self.seed, self.passes = seed, 0
+        self.r, self.sums, self.sq_sums = np.empty(0), np.empty(0), np.empty(0)
+        self.counts = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return self.r.size
+
+    def __str__(self):
+        return f"Sample statistics of {len(self)} radii ({self.counts.sum()} samples, {self.passes} passes)."
+
+    def find(self, r: np.ndarray) -> np.ndarray:
+        """
+        Finds radii coinciding with the known ones.
+        :param r: hit points radii
+        :return: indices of known radii (-1 for new ones)
+        """
+        r = np.asarray(r, dtype=float)
+        if not len(self):
+            return np.full(r.size, -1)
+        idx = np.abs(self.r - r[:, np.newaxis]).argmin(axis=1)
+        return np.where(np.isclose(self.r[idx], r, rtol=1e-12, atol=1e-12), idx, -1)
+
+    def update(self, r: np.ndarray, sums: np.ndarray, sq_sums: np.ndarray, counts: np.ndarray):
+        """
+        Adds statistics of new samples.
+        :param r: hit points radii
+        :param sums: sums of samples
+        :param sq_sums: sums of squared samples
+        :param counts: amounts of samples
+        """
+        idx = self.find(r)
+        old, new = idx >= 0, idx < 0
+        np.add.at(self.sums, idx[old], sums[old])
+        np.add.at(self.sq_sums, idx[old], sq_sums[old])
+        np.add.at(self.counts, idx[old], counts[old])
+        self.r = np.concatenate([self.r, np.asarray(r, dtype=float)[new]])
+        self.sums = np.concatenate([self.sums, sums[new]])
+        self.sq_sums = np.concatenate([self.sq_sums, sq_sums[new]])
+        self.counts = np.concatenate([self.counts, counts[new]])
+        order = self.r.argsort()
+        self.r, self.sums, self.sq_sums, self.counts = (self.r[order], self.sums[order], self.sq_sums[order],
+                                                        self.counts[order])
+
+    def estimate(self, r: np.ndarray) -> np.ndarray:
+        """
+        Interpolates the known mean probabilities (e.g. for the preview of the clarified grid).
+        :param r: hit points radii
+        :return: interpolated mean probabilities
+        """
+        return np.interp(r, self.r, self.sums / self.counts)
+
+
+class Extremum:
+    """
+    Describes the extremum of the approximation function (as scipy.optimize.OptimizeResult's 'x' and 'fun').
+    """
+    __slots__ = ('x', 'fun')
+
+    def __init__(self, x: float, fun: float):
+        """
+        :param x: argument of the extremum
+        :param fun: value of the extremum
+        """
+        self.x, self.fun = np.atleast_1d(x), fun
+
+    def __str__(self):
+        return f"Extremum {self.fun} at x = {self.x[0]}."
@@ -0,0 +1,104 @@
+"""
+Lightweight instrumentation of the solver hot paths (off by default).
+Stages are timed only if profiling is enabled (by enable() or the FUT_PROFILE environment variable),
+otherwise stage() returns the shared no-op context, so the disabled instrumentation costs one call.
+Stages of worker processes (e.g. of the parallel analyze) aren't collected.
+"""
+import json
+import os
+import threading
+from contextlib import nullcontext
+from time import perf_counter
+
+enabled = bool(os.environ.get('FUT_PROFILE'))
+_null = nullcontext()
+_stats = {}         # Stage's name: [calls, total time (s), processed items]
+_trace = []         # Chrome trace's complete events
+_t0 = perf_counter()
+
+
+class _Stage:
+    __slots__ = ('name', 'items', 't')
+
+    def __init__(self, name: str, items: int):
+        # Counts may be NumPy integers, they're stored as int for JSON export
+        self.name, self.items = name, int(items)
+
+    def __enter__(self):
+        self.t = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        dt = perf_counter() - self.t
+        rec = _stats.setdefault(self.name, [0, 0.0, 0])
+        rec[0], rec[1], rec[2] = rec[0] + 1, rec[1] + dt, rec[2] + self.items
+        _trace.append({'name': self.name, 'ph': 'X', 'ts': (self.t - _t0) * 1e6, 'dur': dt * 1e6,
+                       'pid': os.getpid(), 'tid': threading.get_ident(), 'args': {'items': self.items}})
+
+
+def stage(name: str, items: int = 0):
+    """
+    Times the stage (use as 'with stage(...):').
+    :param name: stage's name
+    :param items: amount of processed items (samples, complexes, cells)
+    :return: context manager
+    """
+    return _Stage(name, items) if enabled else _null
+
+
+def enable(on: bool = True):
+    """
+    Enables (or disables) profiling.
+    :param on: enable profiling
+    """
+    global enabled
+    enabled = on
+
+
+def reset():
+    """
+    Clears recorded stages.
+    """
+    global _t0
+    _stats.clear()
+    _trace.clear()
+    _t0 = perf_counter()
+
+
+def records() -> dict:
+    """
+    Makes records of stages.
+    :return: {stage: {'calls', 'time' (s), 'items', 'throughput' (items/s)}}
+    """
+    return {name: {'calls': calls, 'time': t, 'items': items, 'throughput': items / t if t > 0 else 0.0}
+            for name, (calls, t, items) in _stats.items()}
+
+
+def summary() -> str:
+    """
+    Makes the table of stages ordered by total time.
+    :return: table
+    """
+    lines = [f"{'stage':<24}{'calls':>8}{'time, s':>12}{'mean, ms':>12}{'items':>14}{'items/s':>12}"]
+    for name, rec in sorted(records().items(), key=lambda item: -item[1]['time']):
+        lines.append(f"{name:<24}{rec['calls']:>8}{rec['time']:>12.4g}{rec['time'] / rec['calls'] * 1e3:>12.4g}"
+                     f"{rec['items']:>14}{rec['throughput']:>12.4g}")
+    return '\n'.join(lines)
+
+
+def export_json(path: str = 'results/profile.json'):
+    """
+    Exports records of stages to JSON file.
+    :param path: JSON file's path
+    """
+    with open(path, 'w') as f:
+        json.dump(records(), f, indent=2)
+
+
+def export_chrome_trace(path: str = 'results/trace.json'):
+    """
+    Exports stages to Chrome trace file (chrome://tracing, Perfetto).
+    :param path: JSON file's path
+    """
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': _trace, 'displayTimeUnit': 'ms'}, f)
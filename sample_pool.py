@@ -0,0 +1,159 @@
+"""
+Shared-memory pool of samples for the sweep of task #3 (see solver.analyze).
+Only sigma changes the distribution of hit points, so with common random numbers all grid points use the same
+standardized samples: they are drawn once into shared memory (worker processes attach to it without copying),
+distances are calculated once for each sigma and sorted, and each (D1, D2) pair only re-thresholds them:
+distances <= D1 are counted by the binary search and the defeat law is evaluated only between D1 and D2.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+import solver
+from profiling import stage
+
+_pool = None        # Sample pool of the worker process
+
+
+class SamplePool:
+    """
+    Describes standardized samples of all steps in shared memory: normalized hit point offsets z, shape (steps, n, 2),
+    and unit target coordinates (cos(phi), sin(phi)), shape (steps, n, 2). Samples are drawn by the same streams
+    as in solver.stochastic_modelling with the plain estimator, so pooled results are the same (up to rounding).
+    """
+    def __init__(self, steps: int, n: int, name: str = None):
+        """
+        :param steps: amount of hit point radii
+        :param n: amount of samples of each step
+        :param name: name of the shared memory to attach (new shared memory is created if None)
+        """
+        self.steps, self.n = steps, n
+        size = 2 * steps * n * 2 * np.dtype(float).itemsize
+        self.shm = SharedMemory(name=name, create=name is None, size=size if name is None else 0)
+        self.owner = name is None
+        self.offsets = np.ndarray((steps, n, 2), dtype=float, buffer=self.shm.buf)
+        self.units = np.ndarray((steps, n, 2), dtype=float, buffer=self.shm.buf, offset=size // 2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def spec(self) -> tuple:
+        """
+        :return: arguments attaching the pool in another process
+        """
+        return self.steps, self.n, self.shm.name
+
+    def fill(self, seed, r: np.ndarray):
+        """
+        Draws samples of all steps.
+        :param seed: seed, SeedSequence or NumPy random generator of samples
+        :param r: hit points radii (keys of steps' streams)
+        """
+        with stage('sample_pool', self.steps * self.n):
+            for i, (offsets_rng, angles_rng) in enumerate(solver.step_streams(seed, r)):
+                offsets_rng.standard_normal(out=self.offsets[i])
+                phi = angles_rng.uniform(0, 2 * np.pi, self.n)
+                np.cos(phi, out=self.units[i, :, 0])
+                np.sin(phi, out=self.units[i, :, 1])
+        return self
+
+    def sorted_distances(self, r: np.ndarray, R: float, sigma: float) -> np.ndarray:
+        """
+        Calculates sorted distances from hit points to targets for each step (see solver.distances).
+        :param r: hit points radii
+        :param R: target circle's radius
+        :param sigma: hit point standard deviation
+        :return: distances sorted in each step, shape (steps, n)
+        """
+        with stage('pool_distances', self.steps * self.n):
+            d = np.empty((self.steps, self.n))
+            for i, ri in enumerate(r):
+                z, u = self.offsets[i], self.units[i]
+                np.hypot(ri + sigma * z[:, 0] - R * u[:, 0], sigma * z[:, 1] - R * u[:, 1], out=d[i])
+            d.sort(axis=1)
+        return d
+
+    def close(self):
+        """
+        Detaches the pool (and frees shared memory if the pool was created by this process).
+        """
+        self.offsets = self.units = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def threshold_sums(d: np.ndarray, D1: float, D2: float) -> tuple:
+    """
+    Sums the target defeat law of sorted distances of each step.
+    :param d: sorted distances, shape (steps, n)
+    :param D1: diameter of the zone of unconditional target defeat
+    :param D2: diameter of the conditional target defeat zone
+    :return: (sums of samples, sums of squared samples, amounts of samples), shape (steps,) each
+    """
+    sums, sq_sums = np.empty(d.shape[0]), np.empty(d.shape[0])
+    for i, row in enumerate(d):
+        inner = int(np.searchsorted(row, D1, side='right'))
+        # G(d) = 0 for d > max(D1, D2)
+        outer = int(np.searchsorted(row, D2, side='right')) if D2 > D1 else inner
+        g = solver.defeat_law(row[inner:outer], D1, D2)
+        sums[i], sq_sums[i] = inner + g.sum(), inner + g @ g
+    return sums, sq_sums, np.full(d.shape[0], d.shape[1])
+
+
+def pooled_sweep(data: dict, cells: list, seed=None, workers: int = 1) -> list:
+    """
+    Runs stochastic modelling of grid points (D1, D2, sigma) with common random numbers using the sample pool.
+    Grid points are grouped by sigma: each group sorts distances once and re-thresholds them for its (D1, D2) pairs.
+    :param data: input data for stochastic modelling (R, r grid and amount of tests)
+    :param cells: grid points (D1, D2, sigma)
+    :param seed: seed, SeedSequence or NumPy random generator of samples
+    :param workers: amount of worker processes (serial run if 1)
+    :return: (probabilities, standard errors) of each grid point
+    """
+    solver.check_data(data)
+    R, _, _, _, r0, rn, n_steps, N = solver.prepare_values(data)
+    r = np.linspace(r0, rn, n_steps + 1)
+    groups = {}
+    for k, (d1, d2, s) in enumerate(cells):
+        groups.setdefault(float(s), []).append((k, float(d1), float(d2)))
+    # Groups are split to keep all workers busy (distances are sorted once per task)
+    parts = max(-(-workers // max(len(groups), 1)), 1)
+    tasks = [(r, R, s, list(part)) for s, group in groups.items()
+             for part in np.array_split(np.array(group, dtype=object), min(parts, len(group)))]
+    results = [None] * len(cells)
+    with SamplePool(r.size, N) as pool:
+        pool.fill(seed, r)
+        if workers == 1:
+            _attach(pool)
+            runs = map(_pooled_cells, tasks)
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(pool.spec,))
+            runs = executor.map(_pooled_cells, tasks)
+        try:
+            for run in runs:
+                for k, probs, std_errs in run:
+                    results[k] = (probs, std_errs)
+        finally:
+            if workers > 1:
+                executor.shutdown()
+            _attach(None)
+    return results
+
+
+def _attach(pool):
+    # Worker processes attach to the pool once (by its spec), the serial run uses the pool itself
+    global _pool
+    _pool = SamplePool(*pool) if isinstance(pool, tuple) else pool
+
+
+def _pooled_cells(task: tuple) -> list:
+    r, R, sigma, group = task
+    d = _pool.sorted_distances(r, R, sigma)
+    with stage('pool_threshold', len(group) * d.size):
+        return [(k, *solver.mean_std_err(*threshold_sums(d, D1, D2))) for k, D1, D2 in group]
@@ -0,0 +1,291 @@
+"""
+Asyncio job service of the solver: JSON lines over TCP.
+
+Requests (one JSON object per line, 'id' is echoed in responses):
+ - {"id": 1, "type": "modelling", "data": {...}, "seed": 1, "method": "mc", "estimator": "plain"} -
+   stochastic modelling (see solver.stochastic_modelling), results of steps are streamed as
+   {"id": 1, "step": i, "r": r, "p": p, "se": se} when they are done, then {"id": 1, "done": true, ...};
+ - {"id": 2, "type": "delivery", "events": "init/event_*.txt" or [paths]} - delivery probabilities of complexes;
+ - {"id": 3, "type": "metrics"} - latency and throughput metrics of the service.
+Errors are returned as {"id": ..., "error": "..."}.
+Jobs are run by the bounded process pool: the amount of jobs in the pool is limited (the connection isn't read
+while it's full, so clients are throttled by TCP), and identical in-flight seeded requests share one job.
+"""
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+import numpy as np
+
+import data_init
+import fleet
+import solver
+
+_end = object()
+
+
+class Job:
+    """
+    Describes the in-flight job: its messages are replayed to late subscribers and broadcast to all of them.
+    """
+    def __init__(self):
+        self.messages, self.subscribers = [], []
+
+    def publish(self, msg):
+        self.messages.append(msg)
+        for q in self.subscribers:
+            q.put_nowait(msg)
+
+    def subscribe(self) -> asyncio.Queue:
+        q = asyncio.Queue()
+        for msg in self.messages:
+            q.put_nowait(msg)
+        self.subscribers.append(q)
+        return q
+
+
+class Service:
+    """
+    Describes the job service: process pool, in-flight jobs and metrics.
+    """
+    def __init__(self, workers: int = 1, max_pending: int = None, window: int = 1000):
+        """
+        :param workers: amount of worker processes
+        :param max_pending: max amount of step jobs in the pool (2 * workers if None)
+        :param window: amount of the last requests of latency's percentiles
+        """
+        # Forked workers would inherit sockets of open connections (and keep them open), so they're started
+        # by the fork server where it's available
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            ctx = multiprocessing.get_context('forkserver')
+            ctx.set_forkserver_preload(['solver', 'data_init', 'fleet'])
+        else:
+            ctx = multiprocessing.get_context('spawn')
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+        self.slots = asyncio.Semaphore(2 * workers if max_pending is None else max_pending)
+        self.jobs = {}
+        # References of running jobs' tasks (the event loop keeps only weak ones)
+        self.tasks = set()
+        self.latencies = deque(maxlen=window)
+        self.counters = {'requests': 0, 'deduplicated': 0, 'completed': 0, 'errors': 0, 'steps': 0, 'samples': 0}
+        self.t0 = perf_counter()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Serves the connection: requests are processed concurrently, responses are written as they're ready.
+        """
+        lock, tasks = asyncio.Lock(), set()
+
+        async def send(msg: dict):
+            async with lock:
+                writer.write((json.dumps(msg, default=float) + '\n').encode())
+                await writer.drain()
+
+        try:
+            while line := await reader.readline():
+                if not line.strip():
+                    continue
+                # Backpressure: the next request isn't read until the pool has a free slot
+                async with self.slots:
+                    pass
+                task = asyncio.create_task(self.dispatch(line, send))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+
+    async def dispatch(self, line: bytes, send):
+        t = perf_counter()
+        req = {}
+        try:
+            req = json.loads(line)
+            kind = req.get('type')
+            if kind == 'metrics':
+                await send({'id': req.get('id'), 'metrics': self.metrics()})
+                return
+            self.counters['requests'] += 1
+            if kind == 'modelling':
+                await self.modelling(req, send)
+            elif kind == 'delivery':
+                await self.delivery(req, send)
+            else:
+                raise ValueError(f"no such request's type ({kind})")
+            self.counters['completed'] += 1
+            self.latencies.append(perf_counter() - t)
+        except Exception as e:
+            self.counters['errors'] += 1
+            await send({'id': req.get('id') if isinstance(req, dict) else None,
+                        'error': f"{type(e).__name__}: {e}" if str(e) else type(e).__name__})
+
+    async def modelling(self, req: dict, send):
+        data, method, estimator = req['data'], req.get('method', 'mc'), req.get('estimator', 'plain')
+        solver.check_data(data)
+        if method not in solver.methods or estimator not in solver.estimators:
+            raise ValueError(f"no such method ({method}) or estimator ({estimator})")
+        solver.check_kernel(method, estimator)
+        # Unseeded Monte Carlo requests are random, so they aren't deduplicated
+        key = None
+        if req.get('seed') is not None or method == 'analytic':
+            key = hashlib.sha256(json.dumps({k: v for k, v in req.items() if k != 'id'}, sort_keys=True,
+                                            default=str).encode()).hexdigest()
+        await self.subscribe(key, lambda job: self.run_modelling(job, data, req.get('seed'), method, estimator),
+                             req.get('id'), send)
+
+    async def delivery(self, req: dict, send):
+        events = req['events']
+        paths = data_init.sort_event_paths(glob.glob(events)) if isinstance(events, str) else list(events)
+        if not paths:
+            raise ValueError(f"no events' files ({events})")
+        key = hashlib.sha256(json.dumps(['delivery', paths]).encode()).hexdigest()
+        await self.subscribe(key, lambda job: self.run_delivery(job, paths), req.get('id'), send)
+
+    async def subscribe(self, key: str, run, id, send):
+        """
+        Runs the job (or joins the identical in-flight one) and sends its messages.
+        """
+        job = self.jobs.get(key) if key is not None else None
+        if job is None:
+            job = Job()
+            if key is not None:
+                self.jobs[key] = job
+            task = asyncio.create_task(self.run_job(key, job, run))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        else:
+            self.counters['deduplicated'] += 1
+        q = job.subscribe()
+        while (msg := await q.get()) is not _end:
+            if isinstance(msg, Exception):
+                raise msg
+            await send({'id': id, **msg})
+
+    async def run_job(self, key: str, job: Job, run):
+        try:
+            await run(job)
+        except Exception as e:
+            job.publish(e)
+        finally:
+            job.publish(_end)
+            self.jobs.pop(key, None)
+
+    async def submit(self, func, *args):
+        async with self.slots:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, func, *args)
+
+    async def run_modelling(self, job: Job, data: dict, seed, method: str, estimator: str):
+        R, D1, D2, sigma, r0, rn, n_steps, N = solver.prepare_values(data)
+        r = np.linspace(r0, rn, n_steps + 1)
+        if method == 'mc':
+            # Steps are separate jobs with the same streams as in stochastic_modelling
+            root = solver.seed_sequence(seed)
+            futures = [asyncio.ensure_future(self.submit(_model_step, root, i, float(ri), R, D1, D2, sigma, N,
+                                                         estimator)) for i, ri in enumerate(r)]
+        else:
+            futures = [asyncio.ensure_future(self.submit(_model_all, r, R, D1, D2, sigma, N, seed, method,
+                                                         estimator))]
+        probs, std_errs = np.full(r.size, np.nan), np.full(r.size, np.nan)
+        try:
+            for future in asyncio.as_completed(futures):
+                idx, p, se = await future
+                probs[idx], std_errs[idx] = p, se
+                for i in np.atleast_1d(idx):
+                    job.publish({'step': int(i), 'r': r[i], 'p': probs[i], 'se': std_errs[i]})
+                self.counters['steps'] += np.size(idx)
+                self.counters['samples'] += 0 if method == 'analytic' else np.size(idx) * N
+        finally:
+            for future in futures:
+                future.cancel()
+        job.publish({'done': True, 'r': r.tolist(), 'probs': probs.tolist(), 'std_errs': std_errs.tolist()})
+
+    async def run_delivery(self, job: Job, paths: list):
+        probs = await self.submit(_delivery, paths)
+        job.publish({'done': True, 'probs': probs.tolist(), 'best': int(probs.argmax()) + 1})
+
+    def metrics(self) -> dict:
+        """
+        Calculates metrics of the service.
+        :return: counters, in-flight jobs, latency percentiles (s) and throughput since the start
+        """
+        uptime = perf_counter() - self.t0
+        lat = np.array(self.latencies) if self.latencies else np.full(1, np.nan)
+        return {**self.counters, 'in_flight': len(self.jobs), 'uptime': uptime,
+                'latency_p50': float(np.percentile(lat, 50)), 'latency_p95': float(np.percentile(lat, 95)),
+                'requests_per_s': self.counters['completed'] / uptime,
+                'samples_per_s': self.counters['samples'] / uptime}
+
+
+def _model_step(root: np.random.SeedSequence, i: int, ri: float, R: float, D1: float, D2: float,
+                sigma: float, N: int, estimator: str) -> tuple:
+    streams = solver.step_stream(root, solver.radius_key(ri))
+    means = solver.get_control_means(ri, R, D1, D2, sigma) if estimator == 'control' else None
+    probs, std_errs = solver.mean_std_err(*(np.array([x]) for x in solver.step_sums(streams, ri, R, D1, D2, sigma,
+                                                                                      N, estimator, means)))
+    return i, probs[0], std_errs[0]
+
+
+def _model_all(r: np.ndarray, R: float, D1: float, D2: float, sigma: float, N: int, seed, method: str,
+               estimator: str) -> tuple:
+    return (np.arange(r.size), *solver.model_points(r, R, D1, D2, sigma, N, seed, method, estimator))
+
+
+def _delivery(paths: list) -> np.ndarray:
+    return fleet.evaluate_complexes(paths)
+
+
+async def serve(host: str = '127.0.0.1', port: int = 8765, workers: int = 1, max_pending: int = None):
+    """
+    Runs the service until it's cancelled.
+    :param host: host
+    :param port: port
+    :param workers: amount of worker processes
+    :param max_pending: max amount of step jobs in the pool
+    """
+    service = Service(workers, max_pending)
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"Service is listening on {host}:{port} ({workers} workers)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+async def query(requests: list, host: str = '127.0.0.1', port: int = 8765) -> list:
+    """
+    Sends requests over one connection and collects all the responses.
+    :param requests: requests
+    :param host: host
+    :param port: port
+    :return: responses in order of their arrival
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    for req in requests:
+        writer.write((json.dumps(req) + '\n').encode())
+    await writer.drain()
+    writer.write_eof()
+    responses = []
+    while line := await reader.readline():
+        responses.append(json.loads(line))
+    writer.close()
+    return responses
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Asyncio job service of the solver (JSON lines over TCP).")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('-w', '--workers', type=int, default=1, help="amount of worker processes")
+    parser.add_argument('--max-pending', type=int, default=None, help="max amount of jobs in the pool")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.workers, args.max_pending))
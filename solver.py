@@ -1,10 +1,14 @@
 from typing import Union, List
 from math import floor
-from scipy import stats
-from scipy.optimize import minimize
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
 import numpy as np
+# scipy.stats is imported by functions using it (fast startup)
 
-from my_types import FlightComplex
+from my_types import FlightComplex, EventTable, SampleStats, Extremum
+from storage import ResultSink, seed_str
+from cache import ResultCache
+from profiling import stage
 
 
 # For task #1
@@ -18,16 +22,71 @@ def delivery_probs(complexes: Union[FlightComplex, List[FlightComplex]]):
     if isinstance(complexes, FlightComplex):
         return delivery_prob(complexes)
     # Run
-    probs = [1 for _ in range(len(complexes))]
-    for i, complex in enumerate(complexes):
-        t = 0
-        for event in complex.events:
-            if event.distrib == 'norm' or event.distrib == 'uniform':
-                probs[i] *= event.get_prob(t_bias=t)
-            else:
-                probs[i] *= event.get_prob()
-            t += event.tau if event.tau < 100 else 0
-    return probs
+    return list(delivery_probs_table(EventTable.from_complexes(complexes))[1])
+
+
+def delivery_probs_table(table: EventTable) -> tuple:
+    """
+    Calculates the probability of successful payload delivery for each flight complex of the events table.
+    Events are processed as columns: the time's bias of the j-th event of each complex is the sum of times
+    (less than 100) of previous events, so all the complexes are calculated in a few vectorized calls.
+    :param table: table of events of flight complexes
+    :return: (flight complexes' ids, probability of successful payload delivery for each flight complex)
+    """
+    with stage('delivery_probs', table.ids.size):
+        return _delivery_probs_table(table)
+
+
+def _delivery_probs_table(table: EventTable) -> tuple:
+    from scipy import stats
+
+    # Events as (complex, position in complex) matrices, complexes without events have no positions
+    rows = np.searchsorted(table.numbers, table.complex)
+    sizes = np.bincount(rows, minlength=table.numbers.size)
+    starts = np.r_[0, np.cumsum(sizes)[:-1]]
+    cols = np.arange(len(table)) - starts[rows]
+    shape = (table.numbers.size, sizes.max(initial=0))
+    tau = np.zeros(shape)
+    tau[rows, cols] = table.tau
+    # Time's bias (summed in the same order as for the single complex)
+    bias, t = np.zeros(shape), np.zeros(shape[0])
+    for j in range(shape[1]):
+        bias[:, j] = t
+        t += np.where(tau[:, j] < 100, tau[:, j], 0)
+    t_bias = bias[rows, cols]
+
+    event_probs = np.empty(len(table))
+    norm, uniform, expon = (table.code == EventTable.codes[key] for key in ('norm', 'uniform', 'expon'))
+    event_probs[norm] = stats.norm.cdf(table.tau[norm] + t_bias[norm], loc=table.m[norm], scale=table.sigma[norm])
+    event_probs[uniform] = stats.uniform.sf(table.tau[uniform] + t_bias[uniform], loc=table.a[uniform],
+                                            scale=table.b[uniform] - table.a[uniform])
+    event_probs[expon] = stats.expon.sf(table.tau[expon], scale=1 / table.lam[expon])
+
+    probs_matrix = np.ones(shape)
+    probs_matrix[rows, cols] = event_probs
+    probs = np.ones(shape[0])
+    for j in range(shape[1]):
+        probs *= probs_matrix[:, j]
+    return table.ids, probs
+
+
+def delivery_probs_stream(chunks):
+    """
+    Calculates the probability of successful payload delivery for flight complexes incrementally.
+    The last (maybe incomplete) complex of each chunk is carried over to the next chunk.
+    :param chunks: iterable of structured arrays of events (see data_init.iter_event_chunks)
+    :return: generator of (flight complexes' numbers, their probabilities) for each chunk
+    """
+    tail = None
+    for chunk in chunks:
+        if tail is not None:
+            chunk = np.concatenate([tail, chunk])
+        done = chunk['complex'] != chunk['complex'][-1]
+        tail = chunk[~done]
+        if done.any():
+            yield delivery_probs_table(EventTable.from_records(chunk[done]))
+    if tail is not None:
+        yield delivery_probs_table(EventTable.from_records(tail))
 
 
 def delivery_prob(complex: FlightComplex):
@@ -37,8 +96,9 @@ def delivery_prob(complex: FlightComplex):
     :return: the probability of successful payload delivery
     """
     prob = 1
-    for event in complex.events:
-        prob *= event.get_prob()
+    with stage('get_prob', len(complex.events)):
+        for event in complex.events:
+            prob *= event.get_prob()
     return prob
 
 
@@ -57,40 +117,535 @@ def get_needed_n(p1: float, p_req: float) -> int:
 
 
 # For task #2
-def stochastic_modelling(data: dict, to_files: bool = True):
+methods = ('mc', 'analytic', 'kernel')
+# Peak memory per sample in chunks by estimators: offsets, angle, target, distance and defeat arrays
+# (and indicators, their centered copies and least squares temporaries of control variates)
+sample_bytes = {'plain': 72, 'antithetic': 64, 'stratified': 72, 'control': 88}
+estimators = ('plain', 'antithetic', 'stratified', 'control')
+
+
+def stochastic_modelling(data: dict, to_files: bool = True, seed=None, method: str = 'mc',
+                         estimator: str = 'plain', sink: ResultSink = None, cache: ResultCache = None,
+                         state: SampleStats = None, mem_budget: int = 2**27) -> tuple:
+    """
+    Estimates the target defeat probability for each hit point radius using stochastic (Monte Carlo) modelling.
+    Samples of every step are drawn as NumPy array blocks and processed without Python loops
+    (for 'init/data.txt' it is more than 400 times faster than the per-sample scalar loop, see benchmarks.py).
+    Each step has its own random stream spawned from the seed, so runs with the same seed are reproducible.
+    The 'analytic' method calculates the same probabilities by numerical integration (see analytic_probs).
+    :param data: input data for stochastic modelling
+    :param to_files: export results to 'results/results.txt' and 'results/plot.txt'
+    :param seed: seed, SeedSequence or NumPy random generator of samples (OS entropy if None)
+    :param method: 'mc' - Monte Carlo, 'analytic' - numerical integration (seed and n_tests are not used),
+    'kernel' - plain Monte Carlo by the compiled kernel (see kernels.defeat_sums)
+    :param estimator: Monte Carlo variance reduction scheme (see defeat_samples)
+    :param sink: result sink recording the run (with standard errors and seed)
+    :param cache: result cache (only missing points of the r grid are calculated, see ResultCache;
+    unseeded Monte Carlo runs aren't cached)
+    :param state: sample statistics of earlier passes for Monte Carlo (see incremental_modelling)
+    :param mem_budget: memory budget of samples, bytes (samples are drawn by chunks and only their sums are kept,
+    so the peak memory doesn't depend on n_tests)
+    :return: (hit points radii, mean target defeat probabilities)
+    """
     check_data(data)
+    if method not in methods or estimator not in estimators:
+        print(f"Error {ValueError}: no such method ({method}) or estimator ({estimator}) of stochastic modelling!")
+        raise ValueError()
+    check_kernel(method, estimator)
     # Values preparing
     R, D1, D2, sigma, r0, rn, n_steps, N = prepare_values(data)     # N - amount of stochastic tests
     # Run
-    with open('results/results.txt', 'w') as res_file, open('results/plot.txt', 'w') as plot_file:
+    r = np.linspace(r0, rn, n_steps + 1)
+    root = None if method == 'analytic' else seed_sequence(seed)
+    with stage('stochastic_modelling', 0 if method == 'analytic' else r.size * N):
+        if state is not None and method == 'mc':
+            probs, std_errs = incremental_modelling(r, R, D1, D2, sigma, N, state, estimator, mem_budget)
+            root = state.seed
+        elif cache is None or not cache.cacheable(seed, method):
+            probs, std_errs = model_points(r, R, D1, D2, sigma, N, root, method, estimator, mem_budget)
+        else:
+            params = cache.normalize(data, seed_str(root), method, estimator)
+            probs, std_errs, missing = cache.lookup(params, r)
+            if missing.any():
+                probs[missing], std_errs[missing] = model_points(r[missing], R, D1, D2, sigma, N, root, method,
+                                                                 estimator, mem_budget)
+                cache.store(params, r, probs, std_errs)
+
+    # Results
+    if sink is not None:
+        sink.record(data, r, probs, std_errs, root)
+    if to_files:
+        with stage('export_text', r.size):
+            export_text(r, probs)
+    return r, probs
+
+
+def incremental_modelling(r: np.ndarray, R: float, D1: float, D2: float, sigma: float, N: int,
+                          state: SampleStats, estimator: str = 'plain', mem_budget: int = 2**27) -> tuple:
+    """
+    Monte Carlo modelling reusing samples of earlier passes: radii coinciding with known ones only get
+    the additional samples up to N, and new radii get N samples. Statistics of all samples are kept in the state.
+    Each pass has its own random streams spawned from the state's seed.
+    :param r: hit points radii
+    :param R: target circle's radius
+    :param D1: diameter of the zone of unconditional target defeat
+    :param D2: diameter of the conditional target defeat zone
+    :param sigma: hit point standard deviation
+    :param N: amount of stochastic tests for each radius
+    :param state: sample statistics of earlier passes (updated)
+    :param estimator: Monte Carlo variance reduction scheme (see defeat_samples)
+    :param mem_budget: memory budget of samples, bytes
+    :return: (mean target defeat probabilities, standard errors)
+    """
+    state.seed = seed_sequence(state.seed)
+    streams = step_streams(children(state.seed, state.passes + 1)[-1], r)
+    idx = state.find(r)
+    known = np.zeros(r.size, dtype=np.int64)
+    known[idx >= 0] = state.counts[idx[idx >= 0]]
+    needed = np.maximum(N - known, 0)
+    sums, sq_sums, counts = np.zeros(r.size), np.zeros(r.size), np.zeros(r.size, dtype=np.int64)
+    for i in np.flatnonzero(needed):
+        sums[i], sq_sums[i], counts[i] = step_sums(streams[i], r[i], R, D1, D2, sigma, needed[i], estimator,
+                                                   chunk=budget_chunk(mem_budget, estimator))
+    state.update(r, sums, sq_sums, counts)
+    state.passes += 1
+    idx = state.find(r)
+    return mean_std_err(state.sums[idx], state.sq_sums[idx], state.counts[idx])
+
+
+def align_grid(data: dict, state: SampleStats):
+    """
+    Aligns the clarified r grid with the known radii: the step is set to the known step divided (or multiplied,
+    for a coarser requested grid) by an integer and r0, rn are moved to the nearest nodes of such lattice,
+    so the known radii are reused.
+    :param data: input data for stochastic modelling (changed)
+    :param state: sample statistics of earlier passes
+    """
+    if len(state) < 2:
+        return
+    r0, rn, n_steps = float(data['r0']), float(data['rn']), int(data['n_steps'])
+    step, requested = np.diff(state.r).min(), (rn - r0) / n_steps
+    if requested > step:
+        step *= max(int(round(requested / step)), 1)
+    else:
+        step /= max(int(round(step / requested)), 1)
+    j0, jn = int(round((r0 - state.r[0]) / step)), int(round((rn - state.r[0]) / step))
+    jn = max(jn, j0 + 1)
+    data['r0'], data['rn'] = str(round(state.r[0] + j0 * step, 12)), str(round(state.r[0] + jn * step, 12))
+    data['n_steps'] = str(jn - j0)
+
+
+def model_points(r: np.ndarray, R: float, D1: float, D2: float, sigma: float, N: int,
+                 seed=None, method: str = 'mc', estimator: str = 'plain', mem_budget: int = 2**27) -> tuple:
+    """
+    Calculates the target defeat probability for each hit point radius.
+    :param r: hit points radii
+    :param R: target circle's radius
+    :param D1: diameter of the zone of unconditional target defeat
+    :param D2: diameter of the conditional target defeat zone
+    :param sigma: hit point standard deviation
+    :param N: amount of stochastic tests for each radius
+    :param seed: seed, SeedSequence or NumPy random generator of samples
+    :param method: 'mc' - Monte Carlo, 'analytic' - numerical integration, 'kernel' - compiled Monte Carlo kernel
+    :param estimator: Monte Carlo variance reduction scheme (see defeat_samples)
+    :param mem_budget: memory budget of samples, bytes
+    :return: (mean target defeat probabilities, standard errors)
+    """
+    if method == 'analytic':
+        return analytic_probs(r, R, D1, D2, sigma), np.zeros(r.size)
+    if method == 'kernel':
+        import kernels      # Numba is imported only if the kernel is used
+        check_kernel(method, estimator)
+        root = seed_sequence(seed)
+        seeds = [step_sequence(root, radius_key(ri)).generate_state(1)[0] for ri in r]
+        sums, sq_sums = kernels.defeat_sums(r, R, D1, D2, sigma, N, seeds, parallel=True,
+                                            chunk=budget_chunk(mem_budget))
+        return mean_std_err(sums, sq_sums, np.full(r.size, N))
+    streams = step_streams(seed, r)
+    means = get_control_means(r, R, D1, D2, sigma) if estimator == 'control' else [None] * r.size
+    sums = np.array([step_sums(streams[i], ri, R, D1, D2, sigma, N, estimator, means[i],
+                               budget_chunk(mem_budget, estimator))
+                     for i, ri in enumerate(r)])
+    return mean_std_err(*sums.T)
+
+
+def check_kernel(method: str, estimator: str):
+    """
+    Checks that the compiled kernel is used with the plain estimator (it has no variance reduction schemes).
+    :param method: stochastic modelling method
+    :param estimator: Monte Carlo variance reduction scheme
+    """
+    if method == 'kernel' and estimator != 'plain':
+        print(f"Error {ValueError}: the kernel method supports only the plain estimator (not {estimator})!")
+        raise ValueError()
+
+
+def step_sums(streams: tuple, r: float, R: float, D1: float, D2: float, sigma: float, n: int,
+              estimator: str = 'plain', control_means: np.ndarray = None, chunk: int = None) -> tuple:
+    """
+    Draws samples of the target defeat probability by chunks and sums them.
+    For the plain estimator the samples don't depend on the chunk's size.
+    :param streams: (offsets generator, angles generator) of the step
+    :param r: hit point radius
+    :param R: target circle's radius
+    :param D1: diameter of the zone of unconditional target defeat
+    :param D2: diameter of the conditional target defeat zone
+    :param sigma: hit point standard deviation
+    :param n: amount of samples
+    :param estimator: variance reduction scheme (see defeat_samples)
+    :param control_means: probabilities of hits inside D1 and D2 for the 'control' estimator
+    :param chunk: max amount of samples in the chunk (all samples at once if None)
+    :return: (sum of samples, sum of squared samples, amount of samples)
+    """
+    chunk = n if chunk is None else chunk
+    sums, sq_sums, count = 0.0, 0.0, 0
+    for start in range(0, n, chunk):
+        g = defeat_samples(streams, r, R, D1, D2, sigma, min(chunk, n - start), estimator, control_means)
+        sums, sq_sums, count = sums + g.sum(), sq_sums + g @ g, count + g.size
+    return sums, sq_sums, count
+
+
+def budget_chunk(mem_budget: int, estimator: str = 'plain') -> int:
+    """
+    Calculates the chunk's size of samples for the memory budget.
+    :param mem_budget: memory budget of samples, bytes
+    :param estimator: variance reduction scheme (see defeat_samples)
+    :return: amount of samples in the chunk (even, for antithetic pairs)
+    """
+    return max(mem_budget // sample_bytes[estimator] // 2 * 2, 2)
+
+
+def export_text(hit_points: np.ndarray, probs: np.ndarray, res_path: str = 'results/results.txt',
+                plot_path: str = 'results/plot.txt'):
+    """
+    Exports results of stochastic modelling to text files.
+    :param hit_points: hit points radii
+    :param probs: mean target defeat probabilities
+    :param res_path: path of the results file
+    :param plot_path: path of the plot's data file
+    """
+    with open(res_path, 'w') as res_file, open(plot_path, 'w') as plot_file:
         res_file.write("Stochastic modelling results")
         plot_file.write("x\ty")
+        for i, (ri, mean_prob) in enumerate(zip(hit_points, probs)):
+            res_file.write(f"\nStep {i + 1} (r = {ri}): p = {mean_prob}")
+            plot_file.write(f"\n{ri}\t{mean_prob}")
 
-        r = np.linspace(r0, rn, n_steps + 1)
-        phi = stats.uniform(scale=2 * np.pi)
-        x_fc_dist = [stats.norm(loc=ri, scale=sigma) for ri in r]
-        y_fc_dist = stats.norm(scale=sigma)
-
-        hit_points, probs = [], []
-        for i, ri in enumerate(r):
-            temp_probs = []
-            for _ in range(N):
-                # Coordinates of..
-                x_fc, y_fc = x_fc_dist[i].rvs(), y_fc_dist.rvs()    # ..flight complex
-                x_targ, y_targ = target_coords(R, phi.rvs())        # ..target
-                d = np.sqrt((x_fc - x_targ)**2 + (y_fc - y_targ)**2)
-                # Mean probability for current step
-                temp_probs.append(defeat_law(d, D1, D2))
-            mean_prob = np.array(temp_probs).mean()
-
-            # Results
-            hit_points.append(ri)
-            probs.append(mean_prob)
-            if to_files:
-                res_file.write(f"\nStep {i + 1} (r = {ri}): p = {mean_prob}")
-                plot_file.write(f"\n{ri}\t{mean_prob}")
-
-        return np.array(hit_points), np.array(probs)
+
+def adaptive_modelling(data: dict, target_se: float, max_tests: int = None, batch: int = 100, seed=None,
+                       sink: ResultSink = None) -> tuple:
+    """
+    Stochastic modelling with adaptive amount of tests: each step draws batches of samples until the standard
+    error of its estimate is not greater than target_se or the amount of samples reaches max_tests.
+    Steps with the probability near 0 stop after a few batches, so the most of samples go to the peak.
+    :param data: input data for stochastic modelling ('n_tests' is the default max_tests)
+    :param target_se: target standard error of each step's estimate
+    :param max_tests: max amount of samples for each step
+    :param batch: amount of samples in the batch
+    :param seed: seed, SeedSequence or NumPy random generator of samples (OS entropy if None)
+    :param sink: result sink recording the run
+    :return: (hit points radii, mean target defeat probabilities, standard errors, amounts of samples)
+    """
+    check_data(data)
+    R, D1, D2, sigma, r0, rn, n_steps, N = prepare_values(data)
+    max_tests = N if max_tests is None else max_tests
+    if target_se <= 0 or batch < 2 or max_tests < 2:
+        print(f"Error {ValueError}: target_se must be > 0, batch and max_tests must be > 1!")
+        raise ValueError()
+
+    r = np.linspace(r0, rn, n_steps + 1)
+    root = seed_sequence(seed)
+    streams = step_streams(root, r)
+    sums, sq_sums, counts = np.zeros(r.size), np.zeros(r.size), np.zeros(r.size, dtype=int)
+    active = np.ones(r.size, dtype=bool)
+    while active.any():
+        for i in np.flatnonzero(active):
+            g = defeat_samples(streams[i], r[i], R, D1, D2, sigma, min(batch, max_tests - counts[i]))
+            sums[i] += g.sum()
+            sq_sums[i] += g @ g
+            counts[i] += g.size
+        probs, std_errs = mean_std_err(sums, sq_sums, counts)
+        active = (std_errs > target_se) & (counts < max_tests)
+    if sink is not None:
+        sink.record(data, r, probs, std_errs, root)
+    return r, probs, std_errs, counts
+
+
+def mean_std_err(sums: np.ndarray, sq_sums: np.ndarray, counts: np.ndarray) -> tuple:
+    """
+    Calculates means and standard errors of means using sample sums.
+    Standard errors are not less than 1 / n, so the steps without defeats aren't treated as exact ones.
+    :param sums: sums of samples
+    :param sq_sums: sums of squared samples
+    :param counts: amounts of samples
+    :return: (means, standard errors)
+    """
+    means = sums / counts
+    variances = np.maximum(sq_sums - counts * means**2, 0) / (counts - 1)
+    return means, np.maximum(np.sqrt(variances / counts), 1 / counts)
+
+
+def seed_sequence(seed=None) -> np.random.SeedSequence:
+    """
+    Makes the root seed sequence of random streams.
+    :param seed: seed, SeedSequence or NumPy random generator (OS entropy if None)
+    :return: seed sequence
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    if isinstance(seed, np.random.Generator):
+        return seed.bit_generator.seed_seq.spawn(1)[0]
+    return np.random.SeedSequence(seed)
+
+
+def step_streams(seed, r: np.ndarray) -> list:
+    """
+    Spawns independent random streams for the steps of stochastic modelling.
+    Every step has a pair of generators: for hit point offsets and for target angles. Streams are keyed
+    by hit points radii (see radius_key), so the same radius has the same samples in any r grid.
+    :param seed: seed, SeedSequence or NumPy random generator
+    :param r: hit points radii
+    :return: list of (offsets generator, angles generator) pairs
+    """
+    root = seed_sequence(seed)
+    return [step_stream(root, radius_key(ri)) for ri in np.atleast_1d(r)]
+
+
+def step_stream(seed, key: int) -> tuple:
+    """
+    Makes random streams of the one step.
+    :param seed: seed, SeedSequence or NumPy random generator
+    :param key: step's key (see radius_key)
+    :return: (offsets generator, angles generator)
+    """
+    return tuple(np.random.default_rng(child) for child in children(step_sequence(seed, key), 2))
+
+
+def step_sequence(seed, key: int) -> np.random.SeedSequence:
+    """
+    Makes the seed sequence of the one step (the child of the seed with the key, see children).
+    :param seed: seed, SeedSequence or NumPy random generator
+    :param key: step's key
+    :return: seed sequence
+    """
+    ss = seed_sequence(seed)
+    return np.random.SeedSequence(ss.entropy, spawn_key=ss.spawn_key + (key,), pool_size=ss.pool_size)
+
+
+def radius_key(r: float) -> int:
+    """
+    Makes the key of the hit point radius' random streams: the radius is quantized (1e-9), so rounding errors
+    of different r grids give the same key, and mapped to non-negative integers (spawn keys).
+    :param r: hit point radius
+    :return: key
+    """
+    k = int(round(float(r) * 1e9))
+    return 2 * k if k >= 0 else -2 * k - 1
+
+
+def children(ss: np.random.SeedSequence, n: int) -> list:
+    """
+    Makes the first n children of the seed sequence (like SeedSequence.spawn, but without changing its state,
+    so the same seed sequence always gives the same streams).
+    :param ss: parent seed sequence
+    :param n: amount of children
+    :return: list of child seed sequences
+    """
+    return [np.random.SeedSequence(ss.entropy, spawn_key=ss.spawn_key + (i,), pool_size=ss.pool_size)
+            for i in range(n)]
+
+
+def defeat_samples(streams: tuple, r: float, R: float, D1: float, D2: float, sigma: float, n: int,
+                   estimator: str = 'plain', control_means: np.ndarray = None) -> np.ndarray:
+    """
+    Draws samples of the target defeat probability for the hit point radius.
+    Estimators (the mean of samples is the estimate for each of them):
+     - 'plain' - independent samples;
+     - 'antithetic' - (n + 1) // 2 means of pairs (z, phi) and (-z, phi + pi), z - normalized hit point offset;
+     - 'stratified' - one target angle phi in each of n equal strata of [0; 2 * pi]
+       (the standard error of independent samples overestimates its one);
+     - 'control' - samples adjusted by control variates (hits inside D1 and D2 with known Gaussian disk integrals).
+    :param streams: (offsets generator, angles generator) of the step
+    :param r: hit point radius
+    :param R: target circle's radius
+    :param D1: diameter of the zone of unconditional target defeat
+    :param D2: diameter of the conditional target defeat zone
+    :param sigma: hit point standard deviation
+    :param n: amount of samples
+    :param estimator: variance reduction scheme
+    :param control_means: probabilities of hits inside D1 and D2 for the 'control' estimator (see get_control_means)
+    :return: array of the target defeat probabilities
+    """
+    offsets_rng, angles_rng = streams
+    if estimator == 'antithetic':
+        with stage('rng', n):
+            z = offsets_rng.standard_normal(((n + 1) // 2, 2))
+            phi = angles_rng.uniform(0, 2 * np.pi, z.shape[0])
+        with stage('defeat_law', n):
+            return (defeat_law(distances(z, phi, r, R, sigma), D1, D2) +
+                    defeat_law(distances(-z, phi + np.pi, r, R, sigma), D1, D2)) / 2
+
+    with stage('rng', n):
+        z = offsets_rng.standard_normal((n, 2))
+        if estimator == 'stratified':
+            phi = 2 * np.pi * (np.arange(n) + angles_rng.random(n)) / n
+        else:
+            phi = angles_rng.uniform(0, 2 * np.pi, n)
+    with stage('defeat_law', n):
+        d = distances(z, phi, r, R, sigma)
+        g = defeat_law(d, D1, D2)
+    if estimator == 'control':
+        if control_means is None:
+            control_means = get_control_means(r, R, D1, D2, sigma)
+        c = np.stack([d <= D1, d <= D2], axis=1) - control_means
+        b = np.linalg.lstsq(c - c.mean(axis=0), g - g.mean(), rcond=None)[0]
+        return g - c @ b
+    return g
+
+
+def get_control_means(r: Union[float, np.ndarray], R: float, D1: float, D2: float, sigma: float) -> np.ndarray:
+    """
+    Calculates control variates' means: probabilities of hits inside D1 and D2 around the target.
+    :param r: hit point radius (or array of radii)
+    :param R: target circle's radius
+    :param D1: diameter of the zone of unconditional target defeat
+    :param D2: diameter of the conditional target defeat zone
+    :param sigma: hit point standard deviation
+    :return: probabilities, shape (..., 2)
+    """
+    return np.stack([analytic_probs(r, R, D1, D1, sigma), analytic_probs(r, R, D2, D2, sigma)], axis=-1)
+
+
+def distances(z: np.ndarray, phi: np.ndarray, r: float, R: float, sigma: float) -> np.ndarray:
+    """
+    Calculates distances from hit points to targets.
+    :param z: normalized hit point offsets, shape (n, 2)
+    :param phi: target angles
+    :param r: hit point radius
+    :param R: target circle's radius
+    :param sigma: hit point standard deviation
+    :return: distances
+    """
+    x_targ, y_targ = target_coords(R, phi)
+    return np.hypot(r + sigma * z[:, 0] - x_targ, sigma * z[:, 1] - y_targ)
+
+
+def analytic_probs(r: np.ndarray, R: float, D1: float, D2: float, sigma: float,
+                   n_phi: int = 64, n_x: int = 32) -> np.ndarray:
+    """
+    Calculates the target defeat probability for each hit point radius by numerical integration.
+    For the fixed target angle phi the distance d is Rice distributed (noncentral chi with 2 degrees of freedom),
+    and E[G(d)] = 1 / (D2 - D1) * integral of CDF(x) over [D1; D2]. Both the integral over x and the mean over
+    the uniform phi are calculated using Gauss-Legendre quadratures.
+    :param r: hit points radii
+    :param R: target circle's radius
+    :param D1: diameter of the zone of unconditional target defeat
+    :param D2: diameter of the conditional target defeat zone
+    :param sigma: hit point standard deviation
+    :param n_phi: amount of quadrature nodes over phi
+    :param n_x: amount of quadrature nodes over distance
+    :return: target defeat probabilities
+    """
+    from scipy import stats
+
+    r = np.asarray(r, dtype=float)
+    # The distribution is symmetric, so phi in [0; pi]
+    phi, w_phi = np.polynomial.legendre.leggauss(n_phi)
+    phi, w_phi = np.pi / 2 * (phi + 1), w_phi / 2
+    nu = np.sqrt(r[..., np.newaxis]**2 + R**2 - 2 * r[..., np.newaxis] * R * np.cos(phi))    # (r, phi)
+    if D2 > D1:
+        x, w_x = np.polynomial.legendre.leggauss(n_x)
+        x, w_x = (D2 - D1) / 2 * (x + 1) + D1, w_x / 2
+    else:
+        x, w_x = np.array([D1]), np.array([1.0])
+    cdf = stats.ncx2.cdf((x / sigma)**2, 2, (nu[..., np.newaxis] / sigma)**2)                # (r, phi, x)
+    return cdf @ w_x @ w_phi
+
+
+def cross_check(data: dict, seed=None) -> dict:
+    """
+    Compares the analytic target defeat probabilities with the Monte Carlo estimates (of the vectorized engine
+    and of the compiled kernel).
+    :param data: input data for stochastic modelling
+    :param seed: seed of Monte Carlo random streams
+    :return: max absolute errors and max errors in units of Monte Carlo standard errors ('max_abs_err', 'max_z'
+    of the vectorized engine, 'kernel_max_abs_err', 'kernel_max_z' of the kernel)
+    """
+    check_data(data)
+    R, D1, D2, sigma, r0, rn, n_steps, N = prepare_values(data)
+    r = np.linspace(r0, rn, n_steps + 1)
+    probs, std_err = model_points(r, R, D1, D2, sigma, N, seed)
+    kernel_probs, kernel_std_err = model_points(r, R, D1, D2, sigma, N, seed, 'kernel')
+    exact = analytic_probs(r, R, D1, D2, sigma)
+    err, kernel_err = np.abs(probs - exact), np.abs(kernel_probs - exact)
+    # Standard errors of steps with a few nonzero samples underestimate the true ones, so they are floored
+    # by 1 / n (see mean_std_err) and by the largest standard error of G in [0; 1] with the exact mean
+    null_std_err = np.sqrt(exact * (1 - exact) / N)
+    std_err, kernel_std_err = np.maximum(std_err, null_std_err), np.maximum(kernel_std_err, null_std_err)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(std_err > 0, err / std_err, 0.0)
+        kernel_z = np.where(kernel_std_err > 0, kernel_err / kernel_std_err, 0.0)
+    return {'max_abs_err': err.max(), 'max_z': z.max(),
+            'kernel_max_abs_err': kernel_err.max(), 'kernel_max_z': kernel_z.max()}
+
+
+def optimize_hit_radius(data: dict, seed=None, n0: int = 100, growth: float = 1.5, max_tests: int = None,
+                        tol: float = None, z: float = 2.0, alpha: float = 0.05, estimator: str = 'plain') -> tuple:
+    """
+    Finds the optimal hit point radius r* in [r0; rn] by the golden-section search of the noisy defeat probability.
+    Each iterate compares two points using common random numbers: the amount of samples is doubled until
+    the difference is significant (z standard errors) or reaches max_tests. The starting amount of samples
+    grows by the factor growth per iterate, so the most of samples are spent near the optimum.
+    :param data: input data for stochastic modelling ('n_tests' is the amount of samples of the final estimate)
+    :param seed: seed, SeedSequence or NumPy random generator of samples (OS entropy if None)
+    :param n0: starting amount of samples on the first iterate
+    :param growth: growth factor of the starting amount of samples per iterate
+    :param max_tests: max amount of samples per iterate (5 * n_tests if None)
+    :param tol: width of the final bracket of r* (grid step (rn - r0) / n_steps if None)
+    :param z: significance threshold of the difference in standard errors
+    :param alpha: significance level of the confidence band of P(r*)
+    :param estimator: Monte Carlo variance reduction scheme (see defeat_samples)
+    :return: (r*, P(r*), (lower, upper) confidence band of P(r*), total amount of samples)
+    """
+    from scipy import stats
+
+    check_data(data)
+    R, D1, D2, sigma, a, b, n_steps, N = prepare_values(data)
+    tol = (b - a) / n_steps if tol is None else tol
+    max_tests = 5 * N if max_tests is None else max_tests
+    if n0 < 2 or growth < 1 or tol <= 0:
+        print(f"Error {ValueError}: n0 must be > 1, growth must be >= 1 and tol must be > 0!")
+        raise ValueError()
+
+    ratio = (np.sqrt(5) - 1) / 2
+    n_iter = max(int(np.ceil(np.log(tol / (b - a)) / np.log(ratio))), 0)
+    seeds = children(seed_sequence(seed), n_iter + 1)
+    n, total = n0, 0
+    for ss in seeds[:-1]:
+        c, d = b - ratio * (b - a), a + ratio * (b - a)
+        # Common random numbers for both points
+        streams_c, streams_d = step_stream(ss, 0), step_stream(ss, 0)
+        sums, sq_sums, count, batch = 0.0, 0.0, 0, n
+        while True:
+            diff = (defeat_samples(streams_c, c, R, D1, D2, sigma, batch, estimator) -
+                    defeat_samples(streams_d, d, R, D1, D2, sigma, batch, estimator))
+            sums, sq_sums, count = sums + diff.sum(), sq_sums + diff @ diff, count + diff.size
+            total += 2 * batch
+            mean = sums / count
+            if abs(mean) > z * np.sqrt(max(sq_sums / count - mean**2, 0) / count) or count >= max_tests:
+                break
+            batch = min(count, max_tests - count)
+        if mean > 0:
+            b = d
+        else:
+            a = c
+        n = int(np.ceil(n * growth))
+
+    r_max = (a + b) / 2
+    g = defeat_samples(step_stream(seeds[-1], 0), r_max, R, D1, D2, sigma, N, estimator)
+    p_max, std_err = g.mean(), g.std(ddof=1) / np.sqrt(g.size)
+    half_width = stats.norm.ppf(1 - alpha / 2) * std_err
+    return r_max, p_max, (p_max - half_width, p_max + half_width), total + N
 
 
 def check_data(data: dict):
@@ -115,26 +670,27 @@ def prepare_values(data: dict) -> tuple:
             float(data['r0']), float(data['rn']), int(data['n_steps']), int(data['n_tests']))
 
 
-def defeat_law(d: float, D1: float, D2: float) -> float:
+def defeat_law(d: Union[float, np.ndarray], D1: float, D2: float) -> Union[float, np.ndarray]:
     """
     Target defeat law G(d).
-    :param d: current distance from the hit point to the target
+    :param d: current distance (or array of distances) from the hit point to the target
     :param D1: diameter of the zone of unconditional target defeat
     :param D2: diameter of the conditional target defeat zone
-    :return: probability of the target defeat
+    :return: probability (array of probabilities) of the target defeat
     """
-    if D1 < d <= D2:
-        return (D2 - d) / (D2 - D1)
-    if d <= D1:
-        return 1.0
-    return 0.0
+    if D2 <= D1:
+        # No conditional zone
+        g = np.where(d <= D1, 1.0, 0.0)
+    else:
+        g = np.where(d <= D1, 1.0, np.where(d <= D2, (D2 - d) / (D2 - D1), 0.0))
+    return g if g.ndim else float(g)
 
 
-def target_coords(R: float, phi: float) -> tuple:
+def target_coords(R: float, phi: Union[float, np.ndarray]) -> tuple:
     """
     Calculates target moving on circle coordinates.
     :param R: circle's radius
-    :param phi: horizontal angle
+    :param phi: horizontal angle (or array of angles)
     :return: (x, y) coordinates
     """
     return R * np.cos(phi), R * np.sin(phi)
@@ -151,22 +707,69 @@ def clarify(data: dict):
     data['n_tests'] = input("Set amount of stochastic tests: ")
 
 
-def approximate(x: np.ndarray, y: np.ndarray, pwr: int, ismax: bool = True) -> tuple:
+def approximate(x: np.ndarray, y: np.ndarray, pwr: int, ismax: bool = True, std_errs: np.ndarray = None) -> tuple:
     """
     Approximates input data.
+    The extremum is searched in [x.min(); x.max()] among real roots of the derivative and the boundaries
+    (see approximate_batch).
     :param x: data x-axes
     :param y: data y-axes
     :param pwr: polynomial power
-    :param ismax: search max value
-    :return: approximation polynomial coefficients, extremum (max) of approximation function
+    :param ismax: search max value (min value if False)
+    :param std_errs: standard errors of y-values for the inverse-variance weighted fit (unweighted fit if None)
+    :return: approximated values, extremum of approximation function
     """
-    polynom = np.polyfit(x, y, pwr)
-    p_approx = np.polyval(polynom, x)
-    extr_max = minimize(approx_func, x.mean(), args=(polynom[::-1], True))
+    p_approx, x_extr, p_extr = approximate_batch(x, np.asarray(y)[np.newaxis], pwr, ismax,
+                                                 None if std_errs is None else np.asarray(std_errs)[np.newaxis])
+    return p_approx[0], Extremum(x_extr[0], p_extr[0])
 
-    if ismax:
-        extr_max.fun *= -1
-    return p_approx, extr_max
+
+def approximate_batch(x: np.ndarray, y: np.ndarray, pwr: int, ismax: bool = True,
+                      std_errs: np.ndarray = None) -> tuple:
+    """
+    Approximates curves of the common x-grid by polynomials and finds their extrema in one vectorized call.
+    Polynomials are fitted in the scaled argument t in [-1; 1] by normal equations (weighted by inverse variances),
+    roots of derivatives are eigenvalues of stacked companion matrices.
+    :param x: data x-axes, shape (n,)
+    :param y: data y-axes of curves, shape (m, n)
+    :param pwr: polynomial power
+    :param ismax: search max values (min values if False)
+    :param std_errs: standard errors of y-values, shape (m, n) (unweighted fit if None)
+    :return: (approximated values (m, n), arguments of extrema (m,), extrema (m,))
+    """
+    x, y = np.asarray(x, dtype=float), np.atleast_2d(np.asarray(y, dtype=float))
+    center, half = (x.max() + x.min()) / 2, (x.max() - x.min()) / 2
+    t = (x - center) / half
+    with stage('polyfit', y.size):
+        V = np.vander(t, pwr + 1)                                           # highest power first
+        if std_errs is None:
+            coeffs = np.linalg.lstsq(V, y.T, rcond=None)[0].T
+        else:
+            w2 = 1 / np.asarray(std_errs, dtype=float)**2
+            normal = np.einsum('ni,mn,nj->mij', V, w2, V)
+            coeffs = np.linalg.solve(normal, np.einsum('ni,mn->mi', V, w2 * y)[..., np.newaxis])[..., 0]
+        p_approx = coeffs @ V.T
+    with stage('extremum', y.shape[0]):
+        # Candidates: boundaries and real roots of derivatives inside [-1; 1]
+        sign = 1 if ismax else -1
+        candidates = [np.broadcast_to([-1.0, 1.0], (y.shape[0], 2))]
+        if pwr >= 2:
+            deriv = coeffs[:, :-1] * np.arange(pwr, 0, -1)
+            lead = deriv[:, :1]
+            lead = np.where(np.abs(lead) > 1e-300, lead, 1e-300)
+            companion = np.zeros((y.shape[0], pwr - 1, pwr - 1))
+            companion[:, 0, :] = -deriv[:, 1:] / lead
+            companion[:, np.arange(1, pwr - 1), np.arange(pwr - 2)] = 1
+            roots = np.linalg.eigvals(companion)
+            real = (np.abs(roots.imag) <= 1e-9) & (np.abs(roots.real) <= 1)
+            candidates.append(np.where(real, roots.real, -1.0))
+        candidates = np.concatenate(candidates, axis=1)
+        values = np.zeros(candidates.shape)
+        for c in coeffs.T:                                                  # Horner's scheme
+            values = values * candidates + c[:, np.newaxis]
+        best = (sign * values).argmax(axis=1)
+        rows = np.arange(y.shape[0])
+    return p_approx, center + half * candidates[rows, best], values[rows, best]
 
 
 def set_polynom_power() -> int:
@@ -191,32 +794,115 @@ def approx_func(x: float, coeffs: np.ndarray, neg: bool = False) -> float:
     :param neg: mul the result by -1 (True) or not (False)
     :return: approximation value
     """
-    ans = 0
-    for i, k in enumerate(coeffs):
-        ans += k * x**i
+    ans = np.polyval(np.asarray(coeffs)[::-1], x)
     if neg:
         return -ans
     return ans
 
 
-def analyze(data: dict, D1: np.ndarray, D2: np.ndarray, sigma: np.ndarray, pwr: int = 2) -> tuple:
+def analyze(data: dict, D1: np.ndarray, D2: np.ndarray, sigma: np.ndarray, pwr: int = 2,
+            workers: int = 1, seed=None, crn: bool = True, method: str = 'mc', estimator: str = 'plain',
+            sink: ResultSink = None, cache: ResultCache = None, pool: bool = False) -> tuple:
+    """
+    Analyzes D1, D2 and sigma influence on the max target defeat probability.
+    Grid points (D1, D2, sigma) are independent, so with workers > 1 they are farmed out to a process pool.
+    Each grid point gets its own copy of the data and its own random streams, so the results don't depend
+    on the amount of workers. With common random numbers (crn) all grid points use the same streams: it cuts
+    the variance of the differences between grid points, so fewer tests are needed to rank them.
+    :param data: input data for stochastic modelling
+    :param D1: values of the unconditional target defeat zone diameter
+    :param D2: values of the conditional target defeat zone diameter
+    :param sigma: values of the hit point standard deviation
+    :param pwr: approximation polynomial power
+    :param workers: amount of worker processes (serial run if 1)
+    :param seed: seed of the sweep's random streams
+    :param crn: use common random numbers for all grid points (independent streams if False)
+    :param method: stochastic modelling method ('mc' or 'analytic')
+    :param estimator: Monte Carlo variance reduction scheme (see defeat_samples)
+    :param sink: result sink recording runs of all grid points (flushed once at the end of the sweep)
+    :param cache: result cache (grid points cached completely aren't recalculated, unseeded Monte Carlo sweeps
+    aren't cached)
+    :param pool: draw samples once into the shared-memory pool and re-threshold distances of each sigma for all
+    (D1, D2) pairs (see sample_pool, only for Monte Carlo with the plain estimator and common random numbers;
+    memory of the pool is 32 bytes per sample of each step)
+    :return: (r* for each grid point, max probability for each grid point, max probability point)
+    """
+    if workers < 1:
+        print(f"Error {ValueError}: amount of workers must be >= 1!")
+        raise ValueError()
+    if pool and (method != 'mc' or estimator != 'plain' or not crn):
+        print(f"Error {ValueError}: the sample pool needs Monte Carlo with the plain estimator and common random "
+              f"numbers!")
+        raise ValueError()
+    grid = list(product(D1, D2, sigma))
+    root = seed_sequence(seed)
+    seeds = [root] * len(grid) if crn else children(root, len(grid))
+    cells = [dict(data, D1=str(d1), D2=str(d2), sigma=str(s)) for d1, d2, s in grid]
+
+    # Cached grid points
+    runs, params = [None] * len(grid), [None] * len(grid)
+    r = np.linspace(float(data['r0']), float(data['rn']), int(data['n_steps']) + 1)
+    if cache is not None and not cache.cacheable(seed, method):
+        cache = None
+    if cache is not None:
+        for i, (cell, ss) in enumerate(zip(cells, seeds)):
+            params[i] = cache.normalize(cell, seed_str(ss), method, estimator)
+            probs, std_errs, missing = cache.lookup(params[i], r)
+            if not missing.any():
+                runs[i] = (None, seed_str(ss), r, probs, std_errs)
+    tasks = [(i, (cells[i], dict(seed=seeds[i], method=method, estimator=estimator)))
+             for i in range(len(grid)) if runs[i] is None]
+    # Stages of cells are recorded by the profiler only in the serial run
+    with stage('analyze', len(tasks)):
+        if pool and tasks:
+            import sample_pool
+
+            # Pooled runs are recorded as by the sink of _analyze_cell
+            pooled = ResultSink()
+            for (_, (cell, _)), (probs, std_errs) in zip(tasks, sample_pool.pooled_sweep(
+                    data, [grid[i] for i, _ in tasks], root, workers)):
+                pooled.record(cell, r, probs, std_errs, root)
+            results = pooled.buffer
+        elif workers == 1:
+            results = list(map(_analyze_cell, (task for _, task in tasks)))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_analyze_cell, (task for _, task in tasks)))
+    for (i, _), run in zip(tasks, results):
+        runs[i] = run
+        if cache is not None:
+            cache.store(params[i], *run[2:])
+
     r_res, p_res, res_max = [], [], {'D1': None, 'D2': None, 'sigma': None, 'prob': 0}
-    for d1 in D1:
-        data['D1'] = str(d1)
-        print(f"D1 = {d1}")
-        for d2 in D2:
-            data['D2'] = str(d2)
-            print(f"\tD2 = {d2}")
-            for s in sigma:
-                data['sigma'] = str(s)
-                print(f"\t\tsigma = {s}")
-
-                hit_points, p_mean = stochastic_modelling(data)
-                _, extr_max = approximate(hit_points, p_mean, pwr)
-                # Max search
-                if extr_max.fun > res_max['prob']:
-                    res_max['D1'], res_max['D2'], res_max['sigma'], res_max['prob'] = d1, d2, s, extr_max.fun
-                # Detailed results
-                r_res.append(extr_max.x)
-                p_res.append(extr_max.fun)
+    # Curves of all grid points are approximated at once (their r grids are the same), weighted by inverse
+    # variances of Monte Carlo steps (curves without standard errors, e.g. analytic ones, have equal weights)
+    std_errs = np.array([run[4] for run in runs])
+    weighted = (np.isfinite(std_errs) & (std_errs > 0)).all(axis=1)
+    std_errs[~weighted] = 1.0
+    _, r_extr, p_extr = approximate_batch(runs[0][2], np.array([run[3] for run in runs]), pwr,
+                                          std_errs=std_errs if weighted.any() else None)
+    # Results are processed in grid order
+    for (d1, d2, s), r_max, p_max in zip(grid, r_extr, p_extr):
+        print(f"D1 = {d1}, D2 = {d2}, sigma = {s}: P = {p_max}")
+        # Max search
+        if p_max > res_max['prob']:
+            res_max['D1'], res_max['D2'], res_max['sigma'], res_max['prob'] = d1, d2, s, p_max
+        # Detailed results
+        r_res.append(r_max)
+        p_res.append(p_max)
+    if sink is not None:
+        sink.extend([run for run in runs if run[0] is not None])
+        sink.flush()
     return r_res, p_res, res_max
+
+
+def _analyze_cell(task: tuple) -> tuple:
+    """
+    Runs stochastic modelling for the one grid point of the analyze.
+    :param task: (cell's data, stochastic modelling keyword arguments)
+    :return: run recorded by the result sink (parameters, seed, r, probabilities, standard errors)
+    """
+    data, kwargs = task
+    sink = ResultSink()
+    stochastic_modelling(data, to_files=False, sink=sink, **kwargs)
+    return sink.buffer[0]
@@ -0,0 +1,123 @@
+"""
+Binary columnar storage of stochastic modelling results.
+"""
+import os
+import re
+import tempfile
+
+import numpy as np
+
+_shard_name = re.compile(r'^runs_(\d+)\.npz$')
+
+
+class ResultSink:
+    """
+    Buffers runs of stochastic modelling and appends them to the directory as NPZ shards (one shard per flush).
+    Each shard has columns: input parameters, seed, offsets of runs and concatenated r grids, probabilities
+    and standard errors (NaN if unknown).
+    """
+    params = ('R', 'D1', 'D2', 'sigma', 'r0', 'rn', 'n_steps', 'n_tests')
+
+    def __init__(self, directory: str = 'results/runs'):
+        """
+        :param directory: directory of shards
+        """
+        self.directory = directory
+        self.buffer = []
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+    def record(self, data: dict, hit_points: np.ndarray, probs: np.ndarray, std_errs: np.ndarray = None,
+               seed: np.random.SeedSequence = None):
+        """
+        Adds the run to the buffer.
+        :param data: input data of stochastic modelling
+        :param hit_points: hit points radii
+        :param probs: mean target defeat probabilities
+        :param std_errs: standard errors of probabilities
+        :param seed: root seed sequence of the run
+        """
+        hit_points = np.asarray(hit_points, dtype=float)
+        self.buffer.append(([float(data[key]) for key in self.params], seed_str(seed), hit_points,
+                            np.asarray(probs, dtype=float),
+                            np.full(hit_points.size, np.nan) if std_errs is None else np.asarray(std_errs, float)))
+
+    def extend(self, runs: list):
+        """
+        Adds runs buffered by another sink (e.g. in a worker process) to the buffer.
+        :param runs: buffered runs
+        """
+        self.buffer += runs
+
+    def flush(self) -> str:
+        """
+        Writes the buffered runs to the new shard.
+        :return: shard's path (None if the buffer is empty)
+        """
+        if not self.buffer:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        params, seeds, r, probs, std_errs = zip(*self.buffer)
+        offsets = np.cumsum([0] + [x.size for x in r])
+        # Unique temporary file is linked to the shard's name, so readers never see an incomplete shard
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', prefix='runs_', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, params=np.array(params), seed=np.array(seeds), offsets=offsets,
+                         r=np.concatenate(r), probs=np.concatenate(probs), std_errs=np.concatenate(std_errs))
+            # Linking never replaces existing shards: the name taken by another process is retried
+            while True:
+                path = os.path.join(self.directory, f"runs_{self._next_index():05d}.npz")
+                try:
+                    os.link(tmp, path)
+                    break
+                except FileExistsError:
+                    continue
+        finally:
+            os.remove(tmp)
+        self.buffer = []
+        return path
+
+    def _next_index(self) -> int:
+        # Max index of existing shards + 1 (indices of deleted shards aren't reused)
+        indices = [int(m.group(1)) for m in map(_shard_name.match, os.listdir(self.directory)) if m]
+        return max(indices, default=-1) + 1
+
+
+def seed_str(seed: np.random.SeedSequence) -> str:
+    """
+    Represents the seed sequence as a string.
+    :param seed: seed sequence
+    :return: 'entropy:spawn_key' ('' if None)
+    """
+    if seed is None:
+        return ''
+    return f"{seed.entropy}:{','.join(str(k) for k in seed.spawn_key)}"
+
+
+def load_runs(directory: str = 'results/runs') -> dict:
+    """
+    Loads all runs from the directory of shards.
+    :param directory: directory of shards
+    :return: columns: parameters (see ResultSink.params), 'seed', and lists of 'r', 'probs', 'std_errs' of runs
+    """
+    runs = {key: [] for key in ResultSink.params + ('seed', 'r', 'probs', 'std_errs')}
+    if not os.path.isdir(directory):
+        return runs
+    for name in sorted(f for f in os.listdir(directory) if f.startswith('runs_') and f.endswith('.npz')):
+        with np.load(os.path.join(directory, name)) as shard:
+            for i, key in enumerate(ResultSink.params):
+                runs[key] += list(shard['params'][:, i])
+            runs['seed'] += list(shard['seed'])
+            for key in ('r', 'probs', 'std_errs'):
+                runs[key] += np.split(shard[key], shard['offsets'][1:-1])
+    for key in ResultSink.params + ('seed',):
+        runs[key] = np.array(runs[key])
+    return runs
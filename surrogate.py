@@ -0,0 +1,196 @@
+"""
+Surrogate-based sweep of (D1, D2, sigma) for task #3.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from math import comb
+
+import numpy as np
+
+import solver
+
+params = ('D1', 'D2', 'sigma')
+
+
+class PolyChaos:
+    """
+    Describes the polynomial chaos surrogate: expansion over orthonormal Legendre polynomials of inputs
+    uniformly distributed in the box, with multi-indices of the total degree <= degree.
+    Mean and variance (and variance-based sensitivity indices) are calculated from the coefficients.
+    """
+    def __init__(self, bounds: np.ndarray, degree: int = 3):
+        """
+        :param bounds: (lower, upper) bounds of each input, shape (d, 2)
+        :param degree: total degree of the expansion
+        """
+        self.bounds = np.asarray(bounds, dtype=float)
+        self.degree = degree
+        d = self.bounds.shape[0]
+        self.indices = np.array([a for a in product(range(degree + 1), repeat=d) if sum(a) <= degree])
+        self.coeffs = None
+
+    def __len__(self):
+        return len(self.indices)
+
+    def basis(self, x: np.ndarray) -> np.ndarray:
+        """
+        Calculates basis polynomials.
+        :param x: inputs, shape (n, d)
+        :return: values of basis polynomials, shape (n, terms)
+        """
+        lo, hi = self.bounds[:, 0], self.bounds[:, 1]
+        u = 2 * (np.atleast_2d(x) - lo) / (hi - lo) - 1
+        # Orthonormal Legendre polynomials of each input for each degree, shape (n, d, degree + 1)
+        k = np.arange(self.degree + 1)
+        leg = np.stack([np.polynomial.legendre.legval(u, np.eye(self.degree + 1)[j]) for j in k], axis=-1)
+        leg *= np.sqrt(2 * k + 1)
+        d = np.arange(self.bounds.shape[0])
+        return leg[:, d, self.indices].prod(axis=-1)
+
+    def fit(self, x: np.ndarray, y: np.ndarray):
+        """
+        Fits coefficients by least squares.
+        :param x: inputs, shape (n, d)
+        :param y: outputs
+        """
+        if len(y) < len(self):
+            print(f"Error {ValueError}: {len(self)} terms of polynomial chaos need at least as many points!")
+            raise ValueError()
+        self.coeffs = np.linalg.lstsq(self.basis(x), np.asarray(y, dtype=float), rcond=None)[0]
+        return self
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        """
+        Calculates the surrogate's values.
+        :param x: inputs, shape (n, d)
+        :return: outputs
+        """
+        return self.basis(x) @ self.coeffs
+
+    @property
+    def mean(self) -> float:
+        return self.coeffs[0]
+
+    @property
+    def variance(self) -> float:
+        return (self.coeffs[1:]**2).sum()
+
+    def sensitivity(self) -> tuple:
+        """
+        Calculates Sobol sensitivity indices of inputs.
+        :return: (first order indices, total indices)
+        """
+        var = self.coeffs**2 / self.variance
+        active = self.indices > 0
+        only = active & (active.sum(axis=1) == 1)[:, np.newaxis]
+        return var @ only, var @ active
+
+
+def design(n: int, bounds: np.ndarray, kind: str = 'sobol', seed=None) -> np.ndarray:
+    """
+    Makes the space-filling design.
+    :param n: amount of points (rounded up to the power of 2 for Sobol sequence)
+    :param bounds: (lower, upper) bounds of each input, shape (d, 2)
+    :param kind: 'sobol' - scrambled Sobol sequence, 'lhs' - Latin hypercube
+    :param seed: seed of scrambling
+    :return: points, shape (n, d)
+    """
+    from scipy.stats import qmc
+
+    bounds = np.asarray(bounds, dtype=float)
+    if kind == 'sobol':
+        points = qmc.Sobol(bounds.shape[0], seed=seed).random_base2(int(np.ceil(np.log2(max(n, 2)))))
+    elif kind == 'lhs':
+        points = qmc.LatinHypercube(bounds.shape[0], seed=seed).random(n)
+    else:
+        print(f"Error {ValueError}: no such design ({kind})!")
+        raise ValueError()
+    return qmc.scale(points, bounds[:, 0], bounds[:, 1])
+
+
+def evaluate(data: dict, points: np.ndarray, pwr: int = 2, workers: int = 1, seed=None, method: str = 'mc',
+             estimator: str = 'plain') -> np.ndarray:
+    """
+    Calculates max target defeat probabilities P(r*) at points (D1, D2, sigma) by stochastic modelling
+    and approximation as in solver.analyze (all points use common random numbers).
+    :param data: input data for stochastic modelling
+    :param points: points (D1, D2, sigma), shape (n, 3)
+    :param pwr: approximation polynomial power
+    :param workers: amount of worker processes (serial run if 1)
+    :param seed: seed, SeedSequence or NumPy random generator of samples
+    :param method: stochastic modelling method
+    :param estimator: Monte Carlo variance reduction scheme
+    :return: max probabilities
+    """
+    root = None if method == 'analytic' else solver.seed_sequence(seed)
+    tasks = [(dict(data, **{key: str(v) for key, v in zip(params, p)}), pwr,
+              dict(seed=root, method=method, estimator=estimator)) for p in np.atleast_2d(points)]
+    if workers == 1:
+        return np.array(list(map(_evaluate_cell, tasks)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return np.array(list(pool.map(_evaluate_cell, tasks)))
+
+
+def _evaluate_cell(task: tuple) -> float:
+    data, pwr, kwargs = task
+    r, probs = solver.stochastic_modelling(data, to_files=False, **kwargs)
+    return float(np.squeeze(solver.approximate(r, probs, pwr)[1].fun))
+
+
+def surrogate_sweep(data: dict, bounds: np.ndarray, n0: int = 32, degree: int = 3, rounds: int = 3, batch: int = 8,
+                    shrink: float = 0.5, pwr: int = 2, workers: int = 1, seed=None, method: str = 'mc',
+                    estimator: str = 'plain', kind: str = 'sobol') -> dict:
+    """
+    Analyzes D1, D2 and sigma influence on the max target defeat probability using the polynomial chaos surrogate
+    instead of the full grid (see solver.analyze). Initial points are the space-filling design, then each round
+    adds points of the design in the box around the surrogate's argmax (the box shrinks every round) and refits
+    the surrogate. Finally, the argmax is checked by stochastic modelling.
+    :param data: input data for stochastic modelling
+    :param bounds: (lower, upper) bounds of D1, D2 and sigma, shape (3, 2)
+    :param n0: amount of initial points
+    :param degree: total degree of the polynomial chaos
+    :param rounds: amount of refinement rounds
+    :param batch: amount of points added in each round
+    :param shrink: relative size of the refinement box (it's multiplied by shrink every round)
+    :param pwr: approximation polynomial power
+    :param workers: amount of worker processes
+    :param seed: seed of samples and designs
+    :param method: stochastic modelling method
+    :param estimator: Monte Carlo variance reduction scheme
+    :param kind: space-filling design ('sobol' or 'lhs')
+    :return: {'D1', 'D2', 'sigma', 'prob'} of the max (prob by stochastic modelling), surrogate's 'prob_surrogate',
+    'mean' and 'variance', 'sensitivity' ({param: (first order index, total index)}) and 'n_evals'
+    """
+    bounds = np.asarray(bounds, dtype=float)
+    n_terms = comb(degree + bounds.shape[0], degree)
+    if n0 < n_terms:
+        print(f"Error {ValueError}: amount of initial points must be >= {n_terms} for the degree {degree}!")
+        raise ValueError()
+    # All points use the same samples' streams (common random numbers), designs use their own stream
+    root = solver.seed_sequence(seed)
+    rng = np.random.default_rng(solver.children(root, 1)[0])
+    kwargs = dict(pwr=pwr, workers=workers, seed=root, method=method, estimator=estimator)
+    x = design(n0, bounds, kind, rng)
+    y = evaluate(data, x, **kwargs)
+    pc = PolyChaos(bounds, degree).fit(x, y)
+    candidates = design(4096, bounds, 'sobol', rng)
+    best = candidates[pc.predict(candidates).argmax()]
+    width = (bounds[:, 1] - bounds[:, 0]) * shrink
+    for _ in range(rounds):
+        box = np.stack([np.maximum(best - width / 2, bounds[:, 0]), np.minimum(best + width / 2, bounds[:, 1])],
+                       axis=1)
+        x_new = design(batch, box, 'lhs', rng)
+        x, y = np.vstack([x, x_new]), np.r_[y, evaluate(data, x_new, **kwargs)]
+        pc.fit(x, y)
+        best = candidates[pc.predict(candidates).argmax()]
+        width *= shrink
+    # Argmax of the surrogate (dense candidates around the last best point)
+    box = np.stack([np.maximum(best - width, bounds[:, 0]), np.minimum(best + width, bounds[:, 1])], axis=1)
+    candidates = np.vstack([candidates, design(4096, box, 'sobol', rng)])
+    best = candidates[pc.predict(candidates).argmax()]
+    first, total = pc.sensitivity()
+    res = dict(zip(params, best.tolist()))
+    res.update(prob=float(evaluate(data, best, **kwargs)[0]), prob_surrogate=float(pc.predict(best)[0]),
+               mean=float(pc.mean), variance=float(pc.variance), n_evals=len(y) + 1,
+               sensitivity={key: (float(s), float(t)) for key, s, t in zip(params, first, total)})
+    return res
@@ -0,0 +1,110 @@
+"""
+Multi-target and moving-target engine of stochastic modelling.
+"""
+import numpy as np
+
+import solver
+from profiling import stage
+
+
+class Targets:
+    """
+    Describes K targets with trajectories c + radius * (cos(theta), sin(theta)) + v * t, theta = phase + omega * t,
+    t - time of the hit. Targets with random phase (NaN) get independent uniform phases in each sample,
+    so the single target of radius R without motion is the target of solver.stochastic_modelling.
+    """
+    fields = ('x0', 'y0', 'radius', 'omega', 'phase', 'vx', 'vy')
+
+    def __init__(self, x0=0.0, y0=0.0, radius=0.0, omega=0.0, phase=np.nan, vx=0.0, vy=0.0):
+        """
+        :param x0: x of the trajectory's center
+        :param y0: y of the trajectory's center
+        :param radius: radius of the circular motion
+        :param omega: angular speed of the circular motion, rad per time unit
+        :param phase: initial angle of the circular motion (NaN - uniform random)
+        :param vx: x velocity of the center
+        :param vy: y velocity of the center
+        """
+        values = np.broadcast_arrays(*(np.atleast_1d(np.asarray(v, dtype=float)) for v in
+                                       (x0, y0, radius, omega, phase, vx, vy)))
+        self.x0, self.y0, self.radius, self.omega, self.phase, self.vx, self.vy = (v.copy() for v in values)
+        self.random = np.isnan(self.phase)
+
+    def __len__(self):
+        return self.x0.size
+
+    def __str__(self):
+        return f"{len(self)} targets ({self.random.sum()} with random phase)."
+
+    def coords(self, t: np.ndarray, phases: np.ndarray) -> tuple:
+        """
+        Calculates coordinates of all targets at times of hits.
+        :param t: times of hits, shape (n,) (or scalar)
+        :param phases: random phases of targets with NaN phase, shape (amount of random targets, n)
+        :return: (x, y) of targets, shape (K, n) (shape (K, 1) for fixed targets)
+        """
+        n = phases.shape[1] if self.random.any() or np.ndim(t) else 1
+        theta = np.empty((len(self), n))
+        if self.random.any():
+            theta[self.random] = phases
+        theta[~self.random] = self.phase[~self.random, np.newaxis]
+        theta += self.omega[:, np.newaxis] * t
+        x = self.x0[:, np.newaxis] + self.vx[:, np.newaxis] * t + self.radius[:, np.newaxis] * np.cos(theta)
+        y = self.y0[:, np.newaxis] + self.vy[:, np.newaxis] * t + self.radius[:, np.newaxis] * np.sin(theta)
+        return x, y
+
+
+def multi_target_modelling(data: dict, targets: Targets, times: tuple = (0.0, 0.0), seed=None,
+                           mem_budget: int = 2**27) -> tuple:
+    """
+    Estimates target defeat probabilities of K targets for each hit point radius (the hit point is on the x axis).
+    All targets are evaluated against the same hit point samples in one broadcast calculation: offsets and times
+    of hits are drawn once for all targets, only random phases are drawn for each target. Targets are defeated
+    independently given their distances, so the joint probabilities are the means of the products over targets.
+    :param data: input data for stochastic modelling (R isn't used, targets have their own trajectories)
+    :param targets: targets
+    :param times: (min, max) time of the hit (uniform distribution, fixed time if min == max)
+    :param seed: seed, SeedSequence or NumPy random generator of samples (OS entropy if None)
+    :param mem_budget: memory budget of samples, bytes
+    :return: (hit points radii, per-target probabilities (steps, K), probabilities to defeat all targets,
+    probabilities to defeat at least one target)
+    """
+    solver.check_data(data)
+    _, D1, D2, sigma, r0, rn, n_steps, N = solver.prepare_values(data)
+    r = np.linspace(r0, rn, n_steps + 1)
+    K = len(targets)
+    chunk = max(solver.budget_chunk(mem_budget) // (K + 1) // 2 * 2, 2)
+    streams = solver.step_streams(seed, r)
+    probs, p_all, p_any = np.zeros((r.size, K)), np.zeros(r.size), np.zeros(r.size)
+    with stage('multi_target_modelling', r.size * N * K):
+        for i, ri in enumerate(r):
+            offsets_rng, angles_rng = streams[i]
+            for start in range(0, N, chunk):
+                n = min(chunk, N - start)
+                z = offsets_rng.standard_normal((n, 2))
+                phases = angles_rng.uniform(0, 2 * np.pi, (targets.random.sum(), n))
+                t = angles_rng.uniform(*times, n) if times[1] > times[0] else times[0]
+                x, y = targets.coords(t, phases)
+                g = defeat_probs(x - (ri + sigma * z[:, 0]), y - sigma * z[:, 1], D1, D2)
+                probs[i] += g.sum(axis=1)
+                p_all[i] += g.prod(axis=0).sum()
+                p_any[i] += (1 - (1 - g).prod(axis=0)).sum()
+    return r, probs / N, p_all / N, p_any / N
+
+
+def defeat_probs(dx: np.ndarray, dy: np.ndarray, D1: float, D2: float) -> np.ndarray:
+    """
+    Calculates the target defeat law G(d) in place of coordinates' differences (see solver.defeat_law).
+    :param dx: x differences of targets and hit points (overwritten)
+    :param dy: y differences of targets and hit points
+    :param D1: diameter of the zone of unconditional target defeat
+    :param D2: diameter of the conditional target defeat zone
+    :return: probabilities of the target defeat (dx array)
+    """
+    d = np.hypot(dx, dy, out=dx)
+    if D2 <= D1:
+        return np.less_equal(d, D1, out=np.empty(d.shape, dtype=bool)).astype(float)
+    # (D2 - d) / (D2 - D1) >= 1 for d <= D1
+    d -= D2
+    d *= -1 / (D2 - D1)
+    return np.clip(d, 0.0, 1.0, out=d)